@@ -1,11 +1,11 @@
-import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
-import malaria_skeleton as malaria
-import malaria_visualize
-from malaria_skeleton import Model
+import numpy as np
 
+from malaria_core import Model, Observer, keyed_seed
+from malaria_convergence import SteadyStateDetector, stable_statistics
+from malaria_cache import ResultCache, result_key
+import malaria_recorder
 
 # dictionairy where values are list of type:
 # value, changable (True/False), minimum, maximum
@@ -30,130 +30,335 @@ parameters = {
 }
 
 
-def parameter_sweep(steps, init_parameters, parameter, values):
+def run_simulation(model, parameter_values, steps, seed, label="", precision=None):
+    """
+    Run a single simulation and return the infection fraction of every
+    timestep. Module level so it can be sent to a worker process.
+    With precision the run stops early, as soon as the mean infection
+    fraction of the stable phase is known to that precision (see
+    malaria_convergence.SteadyStateDetector), so it can be shorter than
+    steps.
+    """
+    sim = model(**parameter_values, seed=seed)
+    detector = SteadyStateDetector(precision=precision)
+
+    infection_fractions = np.empty(steps)
+    observers = [
+        Observer(lambda record: print(f"{label}t = {record.t}"), max(steps // 10, 1)),
+        lambda record: detector.add(record.infection_fraction),
+    ]
+    for record in sim.run(steps, observers=observers):
+        infection_fractions[record.t] = record.infection_fraction
+        if detector.converged:
+            print(f"{label}stable after t = {record.t}")
+            return infection_fractions[: record.t + 1]
+
+    return infection_fractions
+
+
+def parameter_sweep(
+    steps,
+    init_parameters,
+    parameter,
+    values,
+    model=Model,
+    replicates=1,
+    processes=1,
+    seed=None,
+    precision=None,
+    cache=None,
+    crn=False,
+):
+    """
+    Simulate steps timesteps for each value of parameter and return a
+    dictionary of dataframes with the infection fraction over time.
+    model is the engine to run, Model or malaria_vectorized.VectorizedModel.
+
+    Every (value, replicate) pair is an independent run with its own random
+    stream derived from seed and the pair, so adding values to a sweep
+    leaves the runs of the other values unchanged. With processes=1 the
+    runs are done one after another in this process, otherwise they are
+    spread over a pool of that many worker processes (None uses all
+    cores). With more than one replicate the dataframes have an extra
+    "replicate" column. With precision every run stops once its stable
+    mean infection fraction is known to that precision, see
+    run_simulation.
+
+    With crn=True (common random numbers, see Model) replicate r of every
+    value shares one seed and the models draw per step, event and agent
+    streams, so the runs of different values are paired and differ only
+    through the parameter. Compare them with paired_differences. Only
+    Model supports crn.
+
+    cache is a malaria_cache.ResultCache. Runs found in it are not
+    simulated again and every new run is stored as soon as it is done, so
+    an interrupted sweep continues where it stopped. Runs without a seed
+    are never cached.
+    """
+
+    if crn and not issubclass(model, Model):
+        raise ValueError(f"crn is only supported by Model, not {model.__name__}")
+
+    # copy the parameter values, the caller's dictionairy is never modified
+    base_values = {key: value[0] for key, value in init_parameters.items()}
+
+    if seed is None:
+        cache = None
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    # one task per (value, replicate) pair, each with an independent stream
+    arguments = []
+    keys = []
+    for value in values:
+        for r in range(replicates):
+            parameter_values = dict(base_values)
+            parameter_values[parameter] = value
+            if crn:
+                parameter_values["crn"] = True
+                task_seed = keyed_seed(seed, r)
+            else:
+                task_seed = keyed_seed(seed, value, r)
+            label = f"value = {value}, replicate = {r}, "
+            arguments.append(
+                (model, parameter_values, steps, task_seed, label, precision)
+            )
+            keys.append(
+                result_key(
+                    model, parameter_values, steps, task_seed, precision=precision
+                )
+            )
+
+    # take what is in the cache and simulate the rest
+    results = [cache.get(key) if cache is not None else None for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if cache is not None and len(missing) < len(results):
+        print(f"{len(results) - len(missing)} of {len(results)} runs from cache")
+
+    def store(i, result):
+        results[i] = result
+        if cache is not None:
+            cache.put(keys[i], result, {"parameter": parameter, **arguments[i][1]})
+
+    if processes == 1:
+        for i in missing:
+            store(i, run_simulation(*arguments[i]))
+    elif missing:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            computed = pool.map(run_simulation, *zip(*[arguments[i] for i in missing]))
+            for i, result in zip(missing, computed):
+                store(i, result)
 
     # create dictionairy of dataframes, one for each parameter value
+    import pandas as pd
+
     data_dict = dict()
+    results = iter(results)
 
     for value in values:
-
-        # initialize dataframe
-        df = pd.DataFrame([], columns=["t", "infection_fraction"])
-
-        # get list of parameters
-        parameters = init_parameters
-
-        # update value of sweeped parameter
-        old = parameters[parameter]
-        new = old
-        new[0] = value
-
-        # make list of parameter values
-        parameter_values = [parameters.get(key)[0] for key in parameters.keys()]
-
-        # initialize model
-        sim = Model(*parameter_values)
-
-        # initialize list of infection_fractions and of corresponding times
-        infection_fractions = []
-        t_list = []
-
-        # simulate
-        for t in range(steps):
-
-            if t % int(steps / 10) == 0:
-                print(f"value = {value}, t = {t}")
-
-            data = sim.update()
-
-            # save data
-            t_list.append(t)
-            infection_fractions.append(data[0])
-
-        df["t"] = t_list
-        df["infection_fraction"] = infection_fractions
-
-        data_dict[str(value)] = df
+        frames = []
+        for r in range(replicates):
+            infection_fractions = next(results)
+            df = pd.DataFrame(
+                {
+                    "t": np.arange(infection_fractions.size),
+                    "infection_fraction": infection_fractions,
+                }
+            )
+            if replicates > 1:
+                df.insert(0, "replicate", r)
+            frames.append(df)
+
+        data_dict[str(value)] = pd.concat(frames, ignore_index=True)
 
     return data_dict
 
 
-steps = 1000
-
-# effect of population
-parameter = "nHuman"
-values = [50, 100, 200, 300, 400]
-
-# # effect of pesticide treatment
-# parameter = "mosquitoNaturalDeathProb"
-# values = [0.001, 0.01, 0.02, 0.03, 0.04]
-
-simulate = True
-plot_relation = True
+def paired_differences(data, reference=None):
+    """
+    Paired-difference statistics of a sweep (the dictionary of dataframes
+    of parameter_sweep) against the value reference (the first value by
+    default), as a dataframe with a row per value. Every replicate is
+    reduced to its stable mean infection fraction (after its MSER
+    transient) and paired with the same replicate of the reference. The
+    columns are the mean difference, the standard deviation of the
+    differences and the standard error of their mean, next to the standard
+    error an unpaired comparison of the same runs would have. With crn the
+    paired error is the smaller one, and the number of replicates needed to
+    resolve a difference shrinks with the square of their ratio.
+    """
+    import pandas as pd
+
+    def stable_means(df):
+        if "replicate" not in df:
+            return np.array([stable_statistics(df["infection_fraction"])[0]])
+        return np.array(
+            [
+                stable_statistics(group["infection_fraction"])[0]
+                for _, group in df.groupby("replicate", sort=True)
+            ]
+        )
 
-if simulate == True:
-    data = parameter_sweep(
-        steps=steps,
-        init_parameters=parameters,
-        parameter=parameter,
-        values=values,
-    )
+    if reference is None:
+        reference = next(iter(data))
+    base = stable_means(data[str(reference)])
+
+    rows = []
+    for value, df in data.items():
+        means = stable_means(df)
+        differences = means - base
+        n = differences.size
+        std = np.std(differences, ddof=1) if n > 1 else np.nan
+        unpaired = (
+            np.sqrt((np.var(means, ddof=1) + np.var(base, ddof=1)) / n)
+            if n > 1
+            else np.nan
+        )
+        rows.append(
+            {
+                "value": value,
+                "difference": np.mean(differences),
+                "std": std,
+                "sem": std / np.sqrt(n),
+                "unpaired_sem": unpaired,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def read_sweep(parameter, values, binary=False):
+    """
+    Read the stored sweep data of parameter back into a dictionary of
+    dataframes, one for each value. With binary=True the data is read from
+    the single .npz file written by malaria_recorder.save_sweep, otherwise
+    from the csv file of each value.
+    """
+    import pandas as pd
+
+    if binary:
+        sweep, metadata = malaria_recorder.load_sweep("testdata_" + parameter + ".npz")
+        return {str(value): pd.DataFrame(sweep[str(value)]) for value in values}
+
+    return {
+        str(value): pd.read_csv("testdata_" + parameter + f"_{value}.csv")
+        for value in values
+    }
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
+    steps = 1000
+
+    # effect of population
+    parameter = "nHuman"
+    values = [50, 100, 200, 300, 400]
+
+    # # effect of pesticide treatment
+    # parameter = "mosquitoNaturalDeathProb"
+    # values = [0.001, 0.01, 0.02, 0.03, 0.04]
+
+    simulate = True
+    plot_relation = True
+
+    # number of worker processes for the sweep, None uses all cores
+    processes = None
+
+    # store the sweep in one binary .npz file instead of one csv per value
+    binary = False
+
+    # stop every run once its stable mean infection fraction is known to
+    # this precision (None runs all steps)
+    precision = None
+
+    # reuse the runs of earlier sweeps, stored in this directory (needs a
+    # seed, None disables the cache)
+    seed = 0
+    cache = ResultCache("sweep_cache")
+
+    # independent runs per value, or with crn paired runs that share their
+    # random numbers, reported as differences to the first value
+    replicates = 1
+    crn = False
+
+    if simulate == True:
+        data = parameter_sweep(
+            steps=steps,
+            init_parameters=parameters,
+            parameter=parameter,
+            values=values,
+            processes=processes,
+            seed=seed,
+            precision=precision,
+            cache=cache,
+            replicates=replicates,
+            crn=crn,
+        )
 
-    for i, key in enumerate(data.keys()):
-        df = data[key]
-        df.to_csv("testdata_" + parameter + "_" + key + ".csv")
+        if replicates > 1:
+            print(paired_differences(data))
 
+        if binary:
+            malaria_recorder.save_sweep(
+                "testdata_" + parameter + ".npz",
+                data,
+                parameter,
+                {"steps": steps, "parameters": parameters},
+            )
+        else:
+            for i, key in enumerate(data.keys()):
+                df = data[key]
+                df.to_csv("testdata_" + parameter + "_" + key + ".csv")
 
-if plot_relation == True:
+    if plot_relation == True:
 
-    # plot time evolution for each parameter
-    for value in values:
         # read data
-        df = pd.read_csv(("testdata_" + parameter + f"_{value}.csv"))
-
-        plt.plot(
-            df["t"],
-            df["infection_fraction"],
-            label=parameter + f" = {value}",
+        data = read_sweep(parameter, values, binary)
+
+        # plot time evolution for each parameter
+        for value in values:
+            df = data[str(value)]
+
+            plt.plot(
+                df["t"],
+                df["infection_fraction"],
+                label=parameter + f" = {value}",
+                linewidth=0.5,
+            )
+
+        plt.xlabel("t")
+        plt.ylabel("infection fraction")
+        plt.ylim(0, 0.6)
+        plt.legend()
+        plt.savefig(f"testinfections_over_time_per_{parameter}.png")
+        plt.show()
+
+        stable_infection_fractions = []
+        err_stable_infection_fractions = []
+
+        for value in values:
+            df = data[str(value)]
+
+            # drop the transient (MSER-5) and determine mean and error
+            mean, std, cutoff = stable_statistics(df["infection_fraction"])
+            print(f"{parameter} = {value}: stable after t = {cutoff}")
+            stable_infection_fractions.append(mean)
+            err_stable_infection_fractions.append(std)
+
+        plt.errorbar(
+            values,
+            stable_infection_fractions,
+            yerr=err_stable_infection_fractions,
+            fmt="o-",
+            capsize=4,
             linewidth=0.5,
         )
+        plt.xlabel(parameter)
+        plt.ylabel("infection fraction")
+        plt.title(
+            "Mean infection fraction when stable: \n"
+            "after the detected transient of each run"
+        )
+        plt.savefig("test" + parameter + "_vs_infection.png")
 
-    plt.xlabel("t")
-    plt.ylabel("infection fraction")
-    plt.ylim(0, 0.6)
-    plt.legend()
-    plt.savefig(f"testinfections_over_time_per_{parameter}.png")
-    plt.show()
-
-    fraction = float(input("Which fraction of the total simulation is stable? \n"))
-
-    stable_infection_fractions = []
-    err_stable_infection_fractions = []
-
-    for value in values:
-        # read data
-        df = pd.read_csv(("testdata_" + parameter + f"_{value}.csv"))
-
-        # crop df to fraction
-        df = df[int((1 - fraction) * len(df)) :]
-
-        # determine mean and error and store values
-        stable_infection_fractions.append(np.mean(df["infection_fraction"]))
-        err_stable_infection_fractions.append(np.std(df["infection_fraction"]))
-
-    plt.errorbar(
-        values,
-        stable_infection_fractions,
-        yerr=err_stable_infection_fractions,
-        fmt="o-",
-        capsize=4,
-        linewidth=0.5,
-    )
-    plt.xlabel(parameter)
-    plt.ylabel("infection fraction")
-    plt.title(
-        f"Mean infection fraction when stable: \nfor last {fraction*100}% of {steps} time steps"
-    )
-    plt.savefig("test" + parameter + "_vs_infection.png")
-
-    plt.show()
+        plt.show()
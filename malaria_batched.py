@@ -0,0 +1,462 @@
+import numpy as np
+
+from malaria_core import COLUMNS, DEFAULTS, run_model
+from malaria_vectorized import (
+    IMMUNE,
+    INFECTED,
+    SUSCEPTIBLE,
+    transition_probability,
+)
+
+
+class BatchedModel:
+    def __init__(self, replicas=None, seed=None, rng=None, **parameters):
+        """
+        R independent replicas of VectorizedModel advanced together. Every
+        parameter of Model can be a single value, used by all replicas, or
+        a sequence with one value per replica, e.g. the points of a sweep.
+        The number of replicas R is replicas or the length of the sequences.
+
+        The agents are stored in arrays of shape (R, n) with n the largest
+        population, so a step costs one NumPy operation per phase for all
+        replicas instead of one per replica. Replicas with fewer agents
+        leave the rest of their row inactive (humanActive and
+        mosquitoActive); inactive agents are never on the grid and never
+        change. The grid is shared in the same way, replicas with a smaller
+        width or height use a corner of humanGrid of shape (R, width,
+        height).
+
+        The rules and the distributions of a step are those of
+        VectorizedModel, but the replicas share one random stream, so a
+        replica does not reproduce the VectorizedModel run of the same seed.
+        Every replica keeps its free cells in a pool like FreeCells, see
+        FreeCellPools.
+
+        update() returns the statistics of all replicas as an array of shape
+        (R, 5) in the order of COLUMNS.
+        """
+        unknown = set(parameters) - set(DEFAULTS)
+        if unknown:
+            raise TypeError(f"unknown parameters {sorted(unknown)}")
+        values = dict(DEFAULTS, **parameters)
+
+        lengths = {np.size(value) for value in values.values() if np.ndim(value) > 0}
+        if replicas is not None:
+            lengths.add(replicas)
+        if len(lengths) > 1:
+            raise ValueError(f"parameters with different numbers of replicas {lengths}")
+        self.replicas = lengths.pop() if lengths else 1
+
+        """
+        Model parameters, one value per replica
+        """
+        R = self.replicas
+        self.width = np.broadcast_to(values["width"], R).astype(int)
+        self.height = np.broadcast_to(values["height"], R).astype(int)
+        self.nHuman = np.broadcast_to(values["nHuman"], R).astype(int)
+        self.nMosquito = np.broadcast_to(values["nMosquito"], R).astype(int)
+        for name in (
+            "initMosquitoHungry",
+            "initMosquitoInfected",
+            "humanInfectionProb",
+            "mosquitoInfectionProb",
+            "humanDeathByInfectionProb",
+            "biteProb",
+            "humanNaturalDeathProb",
+            "mosquitoNaturalDeathProb",
+        ):
+            setattr(self, name, np.broadcast_to(values[name], R).astype(float))
+        mealInterval = np.broadcast_to(values["mealInterval"], R)
+        if np.any(mealInterval != np.round(mealInterval)):
+            raise ValueError("mealInterval must be a whole number of timesteps")
+        self.mealInterval = mealInterval.astype(int)
+        self.infectionPeriod = np.full(R, values["infectionPeriod"], dtype=float)
+        self.immunityPeriod = np.full(R, values["immuntiyPeriod"], dtype=float)
+        if np.any(self.nHuman > self.width * self.height):
+            raise ValueError("more humans than grid cells")
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+
+        """
+        Data parameters, one counter per replica
+        """
+        self.infectedCount = np.zeros(R, dtype=int)
+        self.deathCount = np.zeros(R, dtype=int)
+        self.mosquitoDeathCount = np.zeros(R, dtype=int)
+        self.immunityCount = np.zeros(R, dtype=int)
+        self.mosquitoInfectedCount = np.zeros(R, dtype=int)
+
+        """
+        Population setters
+        """
+        self.rows = np.arange(R)[:, None]
+        self.set_human_population(
+            np.broadcast_to(values["initHumanInfected"], R).astype(float)
+        )
+        self.set_mosquito_population()
+
+    def set_human_population(self, initHumanInfected):
+        """
+        Places the humans of every replica on distinct random cells of its
+        grid and infects the first initHumanInfected fraction of them.
+        """
+        R = self.replicas
+        n = self.nHuman.max(initial=0)
+        index = np.arange(n)
+        self.humanActive = index < self.nHuman[:, None]
+
+        # a random permutation of the cells of every grid, by sorting random
+        # keys with the cells outside the grid of the replica moved last
+        shape = (self.width.max(initial=1), self.height.max(initial=1))
+        x, y = np.indices(shape).reshape(2, -1)
+        keys = self.rng.random((R, x.size))
+        keys[(x >= self.width[:, None]) | (y >= self.height[:, None])] = np.inf
+        order = np.argsort(keys, axis=1)
+        cells = order[:, :n]
+        self.humanX = np.where(self.humanActive, x[cells], 0)
+        self.humanY = np.where(self.humanActive, y[cells], 0)
+
+        # the rest of the cells of every grid are its free cells
+        size = self.width * self.height
+        position = np.arange(x.size)
+        group = np.where(
+            position < self.nHuman[:, None],
+            1,
+            np.where(position < size[:, None], 0, 2),
+        )
+        self.freeCells = FreeCellPools(
+            np.take_along_axis(order, np.argsort(group, axis=1, kind="stable"), 1),
+            size - self.nHuman,
+            shape[1],
+        )
+
+        self.humanState = np.where(
+            self.humanActive
+            & (
+                index / np.maximum(self.nHuman, 1)[:, None]
+                <= initHumanInfected[:, None]
+            ),
+            INFECTED,
+            SUSCEPTIBLE,
+        ).astype(np.int8)
+        self.humanLastInfection = np.zeros((R, n), dtype=int)
+        self.humanLastImmunity = np.zeros((R, n), dtype=int)
+
+        self.humanGrid = np.full((R,) + shape, -1, dtype=int)
+        r, j = np.nonzero(self.humanActive)
+        self.humanGrid[r, self.humanX[r, j], self.humanY[r, j]] = j
+
+    def set_mosquito_population(self):
+        """
+        Places the mosquitos of every replica on random cells of its grid,
+        see VectorizedModel.set_mosquito_population.
+        """
+        R = self.replicas
+        n = self.nMosquito.max(initial=0)
+        self.mosquitoActive = np.arange(n) < self.nMosquito[:, None]
+        self.mosquitoX = self.random_cells(self.width[:, None], (R, n))
+        self.mosquitoY = self.random_cells(self.height[:, None], (R, n))
+        self.mosquitoHungry = self.mosquitoActive & self.respawn_hungry(
+            self.rows, np.arange(n)
+        )
+        self.mosquitoInfected = self.mosquitoActive & (
+            self.rng.random((R, n)) <= self.initMosquitoInfected[:, None]
+        )
+        self.mosquitoLastMeal = np.zeros((R, n), dtype=int)
+
+    def random_cells(self, size, shape):
+        """
+        Uniformly random coordinates below size (an array broadcast against
+        shape, e.g. the width of the replica of every entry).
+        """
+        return (self.rng.random(shape) * size).astype(int)
+
+    def respawn_hungry(self, r, index):
+        """
+        Hungry state of (re)spawned mosquitos with the given indices in
+        replicas r, see VectorizedModel.respawn_hungry.
+        """
+        return index / np.maximum(self.nMosquito[r], 1) <= self.initMosquitoHungry[r]
+
+    def update(self):
+        """
+        Perform one timestep in every replica and return the statistics as
+        an array of shape (R, 5), one row like the Model.update tuple per
+        replica.
+        """
+        self.advance()
+        return np.column_stack(self.statistics())
+
+    def run(self, steps, every=1, observers=(), start=0):
+        """
+        Generator of the StepRecord of every every-th of the next steps
+        timesteps, see malaria_skeleton.run_model. The fields of the records
+        are arrays with one value per replica.
+        """
+        return run_model(self, steps, every, observers, start)
+
+    def advance(self):
+        """
+        Perform one timestep in every replica, the phases of
+        VectorizedModel.advance.
+        """
+        self.move_mosquitoes()
+        self.mosquitoInfectedCount = np.count_nonzero(self.mosquitoInfected, axis=1)
+        self.bite_humans()
+        self.update_hunger()
+        self.mosquito_deaths()
+        self.human_deaths(self.recover_humans())
+
+    def statistics(self):
+        """
+        The statistics of the last timestep in the order of COLUMNS, each an
+        array with one value per replica.
+        """
+        return (
+            self.infectedCount / self.nHuman,
+            self.mosquitoInfectedCount / self.nMosquito,
+            self.deathCount.copy(),
+            self.mosquitoDeathCount.copy(),
+            self.immunityCount / self.nHuman,
+        )
+
+    def move_mosquitoes(self):
+        """
+        Moves every active mosquito one step in a random direction with the
+        periodic boundaries of its replica.
+        """
+        delta = self.rng.integers(-1, 2, size=(2,) + self.mosquitoX.shape)
+        delta *= self.mosquitoActive
+        self.mosquitoX = (self.mosquitoX + delta[0]) % self.width[:, None]
+        self.mosquitoY = (self.mosquitoY + delta[1]) % self.height[:, None]
+
+    def bite_humans(self):
+        """
+        Hungry mosquitos on a cell with a human bite with probability
+        biteProb, see VectorizedModel.bite_humans.
+        """
+        target = self.humanGrid[self.rows, self.mosquitoX, self.mosquitoY]
+        r, biting = np.nonzero(
+            self.mosquitoActive
+            & self.mosquitoHungry
+            & (target >= 0)
+            & (self.rng.random(target.shape) <= self.biteProb[:, None])
+        )
+
+        humans = target[r, biting]
+        humanState = self.humanState[r, humans]
+        mosquitoInfected = self.mosquitoInfected[r, biting]
+        roll = self.rng.random(biting.size)
+
+        new = (
+            mosquitoInfected
+            & (humanState == SUSCEPTIBLE)
+            & (roll <= self.humanInfectionProb[r])
+        )
+        self.humanState[r[new], humans[new]] = INFECTED
+        self.humanLastInfection[r[new], humans[new]] = 0
+
+        new = (
+            ~mosquitoInfected
+            & (humanState == INFECTED)
+            & (roll <= self.mosquitoInfectionProb[r])
+        )
+        self.mosquitoInfected[r[new], biting[new]] = True
+
+        self.mosquitoHungry[r, biting] = False
+        self.mosquitoLastMeal[r, biting] = 0
+
+    def update_hunger(self):
+        """
+        Active mosquitos that are not hungry become hungry again after the
+        mealInterval of their replica.
+        """
+        self.mosquitoLastMeal += self.mosquitoActive & ~self.mosquitoHungry
+        hungry = self.mosquitoLastMeal > self.mealInterval[:, None]
+        self.mosquitoHungry |= hungry
+        self.mosquitoLastMeal[hungry] = 0
+
+    def mosquito_deaths(self):
+        """
+        Mosquitos die of natural causes and are replaced by a non-infected
+        mosquito on a random cell of their grid.
+        """
+        dead = self.mosquitoActive & (
+            self.rng.random(self.mosquitoX.shape)
+            <= self.mosquitoNaturalDeathProb[:, None]
+        )
+        self.mosquitoDeathCount += np.count_nonzero(dead, axis=1)
+
+        r, i = np.nonzero(dead)
+        self.mosquitoX[r, i] = self.random_cells(self.width[r], i.size)
+        self.mosquitoY[r, i] = self.random_cells(self.height[r], i.size)
+        self.mosquitoHungry[r, i] = self.respawn_hungry(r, i)
+        self.mosquitoInfected[r, i] = False
+        self.mosquitoLastMeal[r, i] = 0
+
+    def recover_humans(self):
+        """
+        Infected humans recover (and die or become immune) and immune humans
+        lose their immunity, see VectorizedModel.recover_humans. Returns the
+        mask of the humans that died of the infection.
+        """
+        infected = self.humanState == INFECTED
+        immune = self.humanState == IMMUNE
+
+        # add infection to the total when human just got infected
+        self.infectedCount += np.count_nonzero(
+            infected & (self.humanLastInfection == 0), axis=1
+        )
+
+        # end of infection according to normal probability
+        ends = infected & (
+            self.rng.random(infected.shape)
+            <= transition_probability(
+                self.humanLastInfection, self.infectionPeriod[:, None]
+            )
+        )
+        self.humanLastInfection += infected & ~ends
+        self.infectedCount -= np.count_nonzero(ends, axis=1)
+
+        # human dies or gets immune
+        dies = ends & (
+            self.rng.random(ends.shape) <= self.humanDeathByInfectionProb[:, None]
+        )
+        newImmune = ends & ~dies
+        self.deathCount += np.count_nonzero(dies, axis=1)
+        self.humanState[dies] = SUSCEPTIBLE
+        self.humanState[newImmune] = IMMUNE
+        self.humanLastImmunity[newImmune] = 0
+        self.immunityCount += np.count_nonzero(newImmune, axis=1)
+
+        # immunity decays according to the same kind of probability
+        self.humanLastImmunity += immune
+        loses = immune & (
+            self.rng.random(immune.shape)
+            <= transition_probability(
+                self.humanLastImmunity, self.immunityPeriod[:, None]
+            )
+        )
+        self.immunityCount -= np.count_nonzero(loses, axis=1)
+        self.humanState[loses] = SUSCEPTIBLE
+
+        return dies
+
+    def human_deaths(self, infectionDeaths):
+        """
+        Humans die of natural causes. They and the humans in the mask
+        infectionDeaths are replaced by susceptible humans on free cells.
+        """
+        naturalDeaths = self.humanActive & (
+            self.rng.random(self.humanState.shape)
+            <= self.humanNaturalDeathProb[:, None]
+        )
+        self.deathCount += np.count_nonzero(naturalDeaths, axis=1)
+        self.infectedCount -= np.count_nonzero(
+            naturalDeaths & (self.humanState == INFECTED), axis=1
+        )
+        self.immunityCount -= np.count_nonzero(
+            naturalDeaths & (self.humanState == IMMUNE), axis=1
+        )
+
+        self.rebirth_humans(infectionDeaths | naturalDeaths)
+
+    def rebirth_humans(self, mask):
+        """
+        Replaces the humans in mask by susceptible humans on distinct free
+        cells of their grid, keeping humanGrid in sync.
+        """
+        r, j = np.nonzero(mask)
+        if j.size == 0:
+            return
+        x, y = self.humanX[r, j], self.humanY[r, j]
+        self.humanGrid[r, x, y] = -1
+        self.freeCells.release(r, x, y)
+
+        x, y = self.freeCells.take(r, self.rng)
+        self.humanGrid[r, x, y] = j
+        self.humanX[r, j] = x
+        self.humanY[r, j] = y
+
+        self.humanState[mask] = SUSCEPTIBLE
+        self.humanLastInfection[mask] = 0
+        self.humanLastImmunity[mask] = 0
+
+
+class FreeCellPools:
+    def __init__(self, cells, count, height):
+        """
+        A FreeCells pool for every replica of a BatchedModel. Row r of cells
+        holds flat indices (x * height + y) of the cells of the shared grid
+        shape, the first count[r] of them are the free cells of replica r.
+        Cells are taken and released by swapping them across the end of the
+        free range, so the cost does not depend on how full a grid is.
+        """
+        self.cells = cells
+        self.count = np.asarray(count, dtype=int).copy()
+        self.height = height
+        self.slot = np.empty_like(cells)
+        np.put_along_axis(
+            self.slot, cells, np.broadcast_to(np.arange(cells.shape[1]), cells.shape), 1
+        )
+
+    def take(self, r, rng):
+        """
+        Removes a distinct uniformly random free cell of replica r[i] for
+        every i (r sorted) and returns the coordinates x, y. The cells are
+        drawn one replica's draw at a time, as in a Fisher-Yates shuffle, so
+        the number of rounds is the largest number of cells of a replica.
+        """
+        cells = np.empty(r.size, dtype=self.cells.dtype)
+        ranks = np.arange(r.size) - np.searchsorted(r, r)
+        for rank in range(ranks.max(initial=-1) + 1):
+            selected = np.flatnonzero(ranks == rank)
+            rows = r[selected]
+            positions = (rng.random(rows.size) * self.count[rows]).astype(int)
+            cells[selected] = self.cells[rows, positions]
+            self.count[rows] -= 1
+
+            # swap the taken cells with the last free cells
+            last = self.count[rows]
+            lastCells = self.cells[rows, last]
+            self.cells[rows, positions] = lastCells
+            self.cells[rows, last] = cells[selected]
+            self.slot[rows, lastCells] = positions
+            self.slot[rows, cells[selected]] = last
+        return np.divmod(cells, self.height)
+
+    def release(self, r, x, y):
+        """
+        Returns the cells (x[i], y[i]) of replicas r[i] (r sorted) to the
+        pools, see FreeCells.release.
+        """
+        size = self.cells.shape[1]
+        ranks = np.arange(r.size) - np.searchsorted(r, r)
+        positions = r * size + self.slot[r, x * self.height + y]
+        target = r * size + self.count[r] + ranks
+
+        # the same swaps as FreeCells.move_to, on the flattened pools
+        inside = np.isin(positions, target)
+        source = positions[~inside]
+        target = target[~np.isin(target, positions[inside])]
+        cells = self.cells.reshape(-1)
+        slot = self.slot.reshape(-1)
+        sourceCells = cells[source]
+        targetCells = cells[target]
+        cells[source] = targetCells
+        cells[target] = sourceCells
+        slot[source // size * size + targetCells] = source % size
+        slot[target // size * size + sourceCells] = target % size
+        np.add.at(self.count, r, 1)
+
+
+def simulate_batch(parameter_values, steps, replicas=None, seed=None):
+    """
+    Run a BatchedModel with the given parameter_values (single values or one
+    per replica) and return the statistics of every timestep as an array of
+    shape (steps, R, 5).
+    """
+    sim = BatchedModel(replicas, seed=seed, **parameter_values)
+    trajectories = np.empty((steps, sim.replicas, len(COLUMNS)))
+    for record in sim.run(steps):
+        trajectories[record.t] = np.column_stack(record.data)
+    return trajectories
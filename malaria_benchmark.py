@@ -0,0 +1,397 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import LAB5
+import malaria_kernels
+import malaria_recorder
+from malaria_batched import simulate_batch
+from malaria_cells import CellModel
+from malaria_events import EventModel
+from malaria_core import Model
+from malaria_vectorized import VectorizedModel
+
+
+class NumbaModel(VectorizedModel):
+    """
+    VectorizedModel with the numba backend, a class of its own so that
+    parameter sweeps can name it in their cache keys and pickle it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, backend="numba", **kwargs)
+
+
+"""
+Engines and population/grid sizes to benchmark. The first configuration is
+the one of LAB5. The numba engine is only available when Numba is
+installed.
+"""
+ENGINES = {
+    "model": Model,
+    "vectorized": VectorizedModel,
+    "events": EventModel,
+    "cells": CellModel,
+}
+if malaria_kernels.HAVE_NUMBA:
+    ENGINES["numba"] = NumbaModel
+GRID_SIZES = (50, 100)
+HUMAN_COUNTS = (100, 400, 1600)
+MOSQUITO_COUNTS = (500, 4000, 16000)
+SWEEP_VALUES = (50, 100, 200, 300, 400)
+
+"""
+Modules whose import time is measured, from the headless core to the
+script modules that load matplotlib, and whether they must stay headless:
+LAB5 is imported by every sweep worker, so it must not load any of the
+HEAVY_MODULES.
+"""
+IMPORT_MODULES = {
+    "malaria_core": True,
+    "malaria_vectorized": True,
+    "LAB5": True,
+    "malaria_explore": True,
+    "malaria_skeleton": True,
+    "malaria_visualize": False,
+}
+HEAVY_MODULES = ("matplotlib", "pandas", "numba")
+
+
+def lab5_parameters(**changes):
+    """
+    The LAB5 parameter values as keyword arguments for a model, with changes
+    applied.
+    """
+    values = {key: value[0] for key, value in LAB5.parameters.items()}
+    values.update(changes)
+    return values
+
+
+def configurations(quick=False):
+    """
+    List of (name, parameter values) pairs to benchmark. quick only keeps
+    the LAB5 configuration and the smallest and largest populations.
+    """
+    sizes = [(50, 400, 4000)]
+    for size in GRID_SIZES:
+        for nHuman in HUMAN_COUNTS:
+            for nMosquito in MOSQUITO_COUNTS:
+                if (size, nHuman, nMosquito) not in sizes:
+                    sizes.append((size, nHuman, nMosquito))
+    if quick:
+        sizes = [sizes[0], sizes[1], sizes[-1]]
+
+    return [
+        (
+            f"w{size}h{size}/h{nHuman}/m{nMosquito}",
+            lab5_parameters(
+                width=size, height=size, nHuman=nHuman, nMosquito=nMosquito
+            ),
+        )
+        for size, nHuman, nMosquito in sizes
+    ]
+
+
+def measure(function, repeat=1):
+    """
+    Calls function repeat times and returns the best wall time in seconds,
+    the peak traced memory in bytes and the last return value. Memory is
+    traced in one extra call, so the tracing does not slow down the timed
+    calls.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def warm_up(engine, parameter_values):
+    """
+    Runs one untimed step of engine, so the JIT compilation of the numba
+    kernels is not counted in the first timing.
+    """
+    if engine == "numba":
+        ENGINES[engine](**parameter_values, seed=0).advance()
+
+
+def benchmark_model(engine, parameter_values, steps, repeat):
+    """
+    Times the construction of a model and steps calls of update().
+    """
+    model = ENGINES[engine]
+    warm_up(engine, parameter_values)
+
+    initSeconds, initPeak, sim = measure(
+        lambda: model(**parameter_values, seed=0), repeat
+    )
+
+    def run():
+        for _ in range(steps):
+            sim.update()
+
+    updateSeconds, updatePeak, _ = measure(run, repeat)
+    bytesPerAgent = sim.bytes_per_agent()
+    return {
+        "init_seconds": initSeconds,
+        "update_seconds": updateSeconds / steps,
+        "steps_per_second": steps / updateSeconds,
+        "peak_memory_bytes": max(initPeak, updatePeak),
+        "bytes_per_mosquito": bytesPerAgent["mosquito"],
+        "bytes_per_human": bytesPerAgent["human"],
+    }
+
+
+def benchmark_sweep(engine, steps, processes):
+    """
+    Times LAB5.parameter_sweep over the nHuman values of LAB5.
+    """
+    values = list(SWEEP_VALUES)
+    warm_up(engine, lab5_parameters())
+
+    def sweep():
+        # keep the progress output of the sweep out of the JSON output
+        with contextlib.redirect_stdout(io.StringIO()):
+            return LAB5.parameter_sweep(
+                steps,
+                LAB5.parameters,
+                "nHuman",
+                values,
+                model=ENGINES[engine],
+                processes=processes,
+                seed=0,
+            )
+
+    seconds, peak, _ = measure(sweep)
+    return {
+        "seconds": seconds,
+        "steps_per_second": steps * len(values) / seconds,
+        "peak_memory_bytes": peak,
+    }
+
+
+def benchmark_batched_sweep(steps):
+    """
+    Times the sweep of benchmark_sweep as one malaria_batched.BatchedModel
+    with a replica per value.
+    """
+    values = lab5_parameters(nHuman=SWEEP_VALUES)
+    seconds, peak, _ = measure(lambda: simulate_batch(values, steps, seed=0))
+    return {
+        "seconds": seconds,
+        "steps_per_second": steps * len(SWEEP_VALUES) / seconds,
+        "peak_memory_bytes": peak,
+    }
+
+
+def benchmark_io(steps, repeat):
+    """
+    Times writing and reading one trajectory of steps rows as csv with
+    pandas (the LAB5 path) and with malaria_recorder in csv and npz format.
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(steps)
+    data = rng.random((steps, 5))
+    df = pd.DataFrame({"t": t, "infection_fraction": data[:, 0]})
+    results = dict()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data")
+        cases = {
+            "pandas_csv": (
+                lambda: df.to_csv(path + ".csv"),
+                lambda: pd.read_csv(path + ".csv"),
+            ),
+            "recorder_csv": (
+                lambda: malaria_recorder.save(path + ".csv", t, data),
+                lambda: malaria_recorder.load(path + ".csv"),
+            ),
+            "recorder_npz": (
+                lambda: malaria_recorder.save(path + ".npz", t, data),
+                lambda: malaria_recorder.load(path + ".npz"),
+            ),
+        }
+        for name, (write, read) in cases.items():
+            writeSeconds, writePeak, _ = measure(write, repeat)
+            readSeconds, readPeak, _ = measure(read, repeat)
+            results[name] = {
+                "write_seconds": writeSeconds,
+                "read_seconds": readSeconds,
+                "peak_memory_bytes": max(writePeak, readPeak),
+            }
+    return results
+
+
+def benchmark_import(module, repeat):
+    """
+    Times importing module in a fresh interpreter, as a worker process
+    does, and lists which of the HEAVY_MODULES it loads.
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(seconds, *[m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    )
+    directory = os.path.dirname(os.path.abspath(__file__))
+    best = np.inf
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=directory,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        best = min(best, float(output[0]))
+    return {"import_seconds": best, "loads": output[1:]}
+
+
+def run_benchmarks(engines=tuple(ENGINES), steps=20, repeat=3, quick=False):
+    """
+    Runs all benchmarks and returns a JSON serializable dictionary. Every
+    entry of "results" has a unique "name" used to compare runs.
+    """
+    results = []
+    for engine in engines:
+        for name, parameter_values in configurations(quick):
+            print(f"model {engine} {name}", file=sys.stderr)
+            result = benchmark_model(engine, parameter_values, steps, repeat)
+            results.append(dict(name=f"model/{engine}/{name}", engine=engine, **result))
+
+        print(f"sweep {engine}", file=sys.stderr)
+        result = benchmark_sweep(engine, steps, processes=1)
+        results.append(dict(name=f"sweep/{engine}", engine=engine, **result))
+
+    print("sweep batched", file=sys.stderr)
+    result = benchmark_batched_sweep(steps)
+    results.append(dict(name="sweep/batched", engine="batched", **result))
+
+    print("io", file=sys.stderr)
+    for name, result in benchmark_io(1000 if quick else 3000, repeat).items():
+        results.append(dict(name=f"io/{name}", **result))
+
+    print("import", file=sys.stderr)
+    for module, headless in IMPORT_MODULES.items():
+        result = benchmark_import(module, repeat)
+        results.append(dict(name=f"import/{module}", headless=headless, **result))
+
+    return {
+        "metadata": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "steps": steps,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def heavy_imports(results):
+    """
+    Report lines of the headless modules of a run_benchmarks result that
+    load one of the HEAVY_MODULES.
+    """
+    return [
+        f"{result['name']:<45}{'loads':<16}{' '.join(result['loads'])}  REGRESSION"
+        for result in results["results"]
+        if result.get("headless") and result.get("loads")
+    ]
+
+
+def compare(current, baseline, tolerance=0.2):
+    """
+    Compares the timings of two run_benchmarks results. Returns the lines
+    of a report and whether any timing got more than tolerance (relative)
+    slower than the baseline.
+    """
+    baselineResults = {result["name"]: result for result in baseline["results"]}
+    lines = []
+    regression = False
+    for result in current["results"]:
+        old = baselineResults.get(result["name"])
+        if old is None:
+            continue
+        for key, value in result.items():
+            if not key.endswith("_seconds") and key != "seconds":
+                continue
+            if key not in old or old[key] == 0:
+                continue
+            ratio = value / old[key]
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "  REGRESSION"
+                regression = True
+            elif ratio < 1 - tolerance:
+                flag = "  faster"
+            lines.append(f"{result['name']:<45}{key:<16}{ratio:>8.2f}x{flag}")
+    return lines, regression
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the malaria models, the parameter sweep and the "
+        "data output."
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a baseline run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative slowdown reported as regression (default 0.2)",
+    )
+    parser.add_argument(
+        "--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES)
+    )
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--quick", action="store_true", help="only a few configurations"
+    )
+    args = parser.parse_args(arguments)
+
+    results = run_benchmarks(args.engines, args.steps, args.repeat, args.quick)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    heavy = heavy_imports(results)
+    if heavy:
+        print("\n".join(heavy), file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regression = compare(results, baseline, args.tolerance)
+        print("\n".join(lines), file=sys.stderr)
+        return 1 if regression or heavy else 0
+    return 1 if heavy else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from malaria_json import json_value, seed_description
+
+"""
+Version of the model rules. Part of every cache key, so it must be
+increased whenever a change to the models changes their trajectories for a
+given seed, which invalidates all cached results.
+"""
+MODEL_VERSION = 1
+
+
+def result_key(model, parameter_values, steps, seed, **options):
+    """
+    sha256 hex digest identifying the result of a run of model with the
+    keyword arguments in parameter_values, steps timesteps and seed.
+    options are other settings that change the result (e.g. precision).
+    """
+    description = {
+        "version": MODEL_VERSION,
+        "model": f"{model.__module__}.{model.__qualname__}",
+        "parameters": parameter_values,
+        "steps": steps,
+        "seed": seed_description(seed),
+        "options": options,
+    }
+    text = json.dumps(description, sort_keys=True, default=json_value)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory="sweep_cache", maxBytes=1 << 30):
+        """
+        Content addressed store of simulation results (arrays) on disk.
+        Every result is a .npy file named after its key (see result_key).
+        manifest.json lists the stored results with their size and the time
+        of their last use; it is rewritten after every change, so an
+        interrupted sweep keeps everything it finished. When the results
+        take more than maxBytes, the least recently used ones are removed.
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.manifestPath = os.path.join(directory, "manifest.json")
+        os.makedirs(directory, exist_ok=True)
+
+        self.manifest = dict()
+        if os.path.exists(self.manifestPath):
+            with open(self.manifestPath) as f:
+                self.manifest = json.load(f)
+
+        # drop entries whose file went missing
+        for key in list(self.manifest):
+            if not os.path.exists(self.path(key)):
+                del self.manifest[key]
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def __contains__(self, key):
+        return key in self.manifest
+
+    def __len__(self):
+        return len(self.manifest)
+
+    @property
+    def size(self):
+        """
+        Total size in bytes of the stored results.
+        """
+        return sum(entry["size"] for entry in self.manifest.values())
+
+    def get(self, key):
+        """
+        The stored result of key, or None when it is not in the cache.
+        """
+        if key not in self.manifest:
+            return None
+        result = np.load(self.path(key))
+        self.manifest[key]["used"] = time.time()
+        self.write_manifest()
+        return result
+
+    def put(self, key, result, description=None):
+        """
+        Stores the array result under key. description (JSON serializable,
+        e.g. the parameters of the run) is kept in the manifest for
+        inspection.
+        """
+        result = np.asarray(result)
+        temporary = os.path.join(self.directory, key + ".tmp.npy")
+        np.save(temporary, result)
+        os.replace(temporary, self.path(key))
+
+        self.manifest[key] = {
+            "size": os.path.getsize(self.path(key)),
+            "used": time.time(),
+            "description": description,
+        }
+        self.evict()
+        self.write_manifest()
+
+    def evict(self):
+        """
+        Removes the least recently used results until the cache fits in
+        maxBytes.
+        """
+        size = self.size
+        for key in sorted(self.manifest, key=lambda k: self.manifest[k]["used"]):
+            if size <= self.maxBytes:
+                break
+            size -= self.manifest.pop(key)["size"]
+            os.remove(self.path(key))
+
+    def clear(self):
+        for key in list(self.manifest):
+            os.remove(self.path(key))
+        self.manifest.clear()
+        self.write_manifest()
+
+    def write_manifest(self):
+        temporary = self.manifestPath + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.manifest, f, indent=1, default=repr)
+        os.replace(temporary, self.manifestPath)
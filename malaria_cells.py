@@ -0,0 +1,242 @@
+import numpy as np
+
+from malaria_core import Mosquito
+from malaria_vectorized import INFECTED, SUSCEPTIBLE, VectorizedModel
+
+
+class CellModel(VectorizedModel):
+    """
+    VectorizedModel in which the mosquitos are not individuals but counts
+    per cell. mosquitoCounts[a, infected, x, y] is the number of mosquitos
+    on cell (x, y) that are infected (1) or not (0), and that are hungry
+    (a = 0) or had their last meal a - 1 steps ago (a = 1 .. mealInterval
+    + 1). Memory and the cost of a step scale with the grid size and
+    mealInterval instead of nMosquito, so swarms of millions of mosquitos
+    are cheap.
+
+    Every phase draws the same distributions as the agent engines:
+
+    - moving is a multinomial split of every count over its cell and the 8
+      neighbour cells, with periodic boundaries
+    - the hungry mosquitos on a cell with a human bite binomially; the
+      human is infected when at least one infected bite passes the
+      infection roll, and the non-infected biters of an infected human
+      are infected binomially
+    - deaths are binomial per count, and the dead respawn on uniformly
+      random cells, hungry with the same probability as in
+      VectorizedModel.respawn_hungry
+
+    The humans are individual agents exactly as in VectorizedModel.
+    mosquitoX, mosquitoY, mosquitoInfected, mosquitoHungry and
+    mosquitoLastMeal expand the counts into per mosquito arrays (in no
+    particular order) when read, e.g. for the visualization.
+    """
+
+    def set_mosquito_population(self, initMosquitoHungry, initMosquitoInfected):
+        """
+        Places the mosquitos on random cells like
+        VectorizedModel.set_mosquito_population, with the sated ones at a
+        last meal of 0 steps ago.
+        """
+        if self.backend != "numpy":
+            raise ValueError("CellModel only supports the numpy backend")
+
+        self.mosquitoCounts = np.zeros(
+            (self.mealInterval + 2, 2, self.width, self.height), dtype=np.int64
+        )
+        nHungry = int(np.count_nonzero(self.respawn_hungry(np.arange(self.nMosquito))))
+        self.hungryFraction = nHungry / max(self.nMosquito, 1)
+        self.mosquitoCounts[0, 0] = self.scatter(nHungry)
+        self.mosquitoCounts[1, 0] = self.scatter(self.nMosquito - nHungry)
+
+        infected = self.rng.binomial(self.mosquitoCounts[:, 0], initMosquitoInfected)
+        self.mosquitoCounts[:, 0] -= infected
+        self.mosquitoCounts[:, 1] += infected
+
+    def scatter(self, n):
+        """
+        Counts per cell of n mosquitos placed on uniformly random cells.
+        """
+        cells = self.width * self.height
+        counts = self.rng.multinomial(n, np.full(cells, 1 / cells))
+        return counts.reshape(self.width, self.height)
+
+    def count_infected_mosquitoes(self):
+        return int(self.mosquitoCounts[:, 1].sum())
+
+    def move_mosquitoes(self):
+        """
+        Moves the mosquitos one step in a random direction with periodic
+        boundaries. deltaX and deltaY are independent and uniform on -1, 0
+        and 1, so the multinomial split over the 9 neighbours is done as a
+        split over the 3 x moves followed by one over the 3 y moves, each as
+        two binomials.
+        """
+        for axis in (-2, -1):
+            counts = self.mosquitoCounts
+            down = self.rng.binomial(counts, 1 / 3)
+            up = self.rng.binomial(counts - down, 1 / 2)
+            self.mosquitoCounts = (
+                counts
+                - down
+                - up
+                + np.roll(down, -1, axis=axis)
+                + np.roll(up, 1, axis=axis)
+            )
+
+    def bite_humans(self):
+        """
+        Hungry mosquitos on a cell with a human bite with probability
+        biteProb, see VectorizedModel.bite_humans. The bites are resolved
+        against the human states at the start of the phase.
+        """
+        humans = self.humanGrid[self.humanGrid >= 0]
+        hungry = self.mosquitoCounts[0][:, self.humanGrid >= 0]
+        biting = self.rng.binomial(hungry, self.biteProb)
+        state = self.humanState[humans]
+
+        # a human is infected when at least one infected bite passes the roll
+        susceptible = (state == SUSCEPTIBLE) & (biting[1] > 0)
+        passed = self.rng.binomial(biting[1][susceptible], self.humanInfectionProb)
+        newHumans = humans[susceptible][passed > 0]
+        self.infect_humans(newHumans)
+
+        # non-infected biters of an infected human can get infected
+        newMosquitos = np.zeros_like(biting[0])
+        infectious = (state == INFECTED) & (biting[0] > 0)
+        newMosquitos[infectious] = self.rng.binomial(
+            biting[0][infectious], self.mosquitoInfectionProb
+        )
+
+        # the biters are no longer hungry, they are aged in update_hunger
+        self.fed = np.zeros_like(self.mosquitoCounts[0])
+        self.fed[:, self.humanGrid >= 0] = biting
+        self.fed[0, self.humanGrid >= 0] -= newMosquitos
+        self.fed[1, self.humanGrid >= 0] += newMosquitos
+        self.mosquitoCounts[0][:, self.humanGrid >= 0] -= biting
+
+        if self.profiler:
+            self.profiler.count("bites", biting.sum())
+            self.profiler.count("human_infections", newHumans.size)
+            self.profiler.count("mosquito_infections", newMosquitos.sum())
+
+    def update_hunger(self):
+        """
+        The sated mosquitos (including the ones that just fed) get one step
+        older and become hungry again after mealInterval timesteps.
+        """
+        sated = self.mosquitoCounts[1:]
+        sated[0] += self.fed
+        self.mosquitoCounts[0] += sated[-1]
+        sated[1:] = sated[:-1].copy()
+        sated[0] = 0
+
+    def mosquito_deaths(self):
+        """
+        Mosquitos die of natural causes and are replaced by non-infected
+        mosquitos on random cells.
+        """
+        dead = self.rng.binomial(self.mosquitoCounts, self.mosquitoNaturalDeathProb)
+        self.mosquitoCounts -= dead
+        n = int(dead.sum())
+        self.mosquitoDeathCount += n
+        if self.profiler:
+            self.profiler.count("mosquito_respawns", n)
+
+        nHungry = int(self.rng.binomial(n, self.hungryFraction))
+        self.mosquitoCounts[0, 0] += self.scatter(nHungry)
+        self.mosquitoCounts[1, 0] += self.scatter(n - nHungry)
+
+    def bytes_per_agent(self):
+        """
+        Memory per mosquito of the counts (which depends on the grid size
+        and mealInterval, not on nMosquito) and per human in bytes.
+        """
+        result = super().bytes_per_agent()
+        result["mosquito"] = self.mosquitoCounts.nbytes / max(self.nMosquito, 1)
+        return result
+
+    def checkpoint_arrays(self):
+        """
+        The human arrays and mosquitoCounts. The counts are also expanded
+        into the per mosquito arrays, so the other engines can continue
+        from the checkpoint of a CellModel.
+        """
+        arrays = super().checkpoint_arrays()
+        arrays["mosquitoCounts"] = self.mosquitoCounts
+        return arrays
+
+    def restore_arrays(self, arrays):
+        """
+        Takes over the arrays of a checkpoint. Without mosquitoCounts (the
+        checkpoint of another engine) the counts are built from the per
+        mosquito arrays.
+        """
+        for name in self.humanArrays:
+            dtype = getattr(self, name).dtype
+            setattr(self, name, np.asarray(arrays[name], dtype=dtype))
+
+        if "mosquitoCounts" in arrays:
+            self.mosquitoCounts = np.asarray(arrays["mosquitoCounts"], dtype=np.int64)
+        else:
+            self.mosquitoCounts = np.zeros(
+                (self.mealInterval + 2, 2, self.width, self.height), dtype=np.int64
+            )
+            hungry = np.asarray(arrays["mosquitoHungry"])
+            lastMeal = np.minimum(arrays["mosquitoLastMeal"], self.mealInterval)
+            age = np.where(hungry, 0, lastMeal + 1)
+            np.add.at(
+                self.mosquitoCounts,
+                (
+                    age,
+                    np.asarray(arrays["mosquitoInfected"], dtype=int),
+                    arrays["mosquitoX"],
+                    arrays["mosquitoY"],
+                ),
+                1,
+            )
+
+        nHungry = int(np.count_nonzero(self.respawn_hungry(np.arange(self.nMosquito))))
+        self.hungryFraction = nHungry / max(self.nMosquito, 1)
+
+    """
+    Per mosquito arrays expanded from the counts, for code written against
+    VectorizedModel. Every access builds new arrays of nMosquito entries.
+    """
+
+    def expand(self):
+        """
+        Age class, infection, x and y of every mosquito.
+        """
+        index = np.nonzero(self.mosquitoCounts)
+        repeats = self.mosquitoCounts[index]
+        return [np.repeat(i, repeats) for i in index]
+
+    @property
+    def mosquitoPopulation(self):
+        population = []
+        for a, infected, x, y in zip(*[i.tolist() for i in self.expand()]):
+            m = Mosquito(x, y, a == 0, bool(infected))
+            m.lastMeal = max(a - 1, 0)
+            population.append(m)
+        return population
+
+    @property
+    def mosquitoX(self):
+        return self.expand()[2]
+
+    @property
+    def mosquitoY(self):
+        return self.expand()[3]
+
+    @property
+    def mosquitoInfected(self):
+        return self.expand()[1].astype(bool)
+
+    @property
+    def mosquitoHungry(self):
+        return self.expand()[0] == 0
+
+    @property
+    def mosquitoLastMeal(self):
+        return np.maximum(self.expand()[0] - 1, 0)
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from malaria_json import seed_description
+
+"""
+Counters of a model that are saved with its state, and the arrays of a
+checkpoint. A checkpoint is a directory with one .npy file per array and a
+metadata.json file, so every array can be memory-mapped when it is loaded.
+Engines can add arrays of their own to checkpoint_arrays, they are saved
+and passed to restore_arrays as well.
+"""
+COUNTERS = (
+    "infectedCount",
+    "deathCount",
+    "mosquitoDeathCount",
+    "immunityCount",
+    "mosquitoInfectedCount",
+    "step",
+)
+ARRAYS = (
+    "mosquitoX",
+    "mosquitoY",
+    "mosquitoHungry",
+    "mosquitoInfected",
+    "mosquitoLastMeal",
+    "humanX",
+    "humanY",
+    "humanState",
+    "humanLastInfection",
+    "humanLastImmunity",
+    "freeCells",
+)
+PARAMETERS = (
+    "width",
+    "height",
+    "initMosquitoHungry",
+    "initMosquitoInfected",
+    "humanInfectionProb",
+    "mosquitoInfectionProb",
+    "humanDeathByInfectionProb",
+    "biteProb",
+    "mealInterval",
+    "infectionPeriod",
+    "humanNaturalDeathProb",
+    "mosquitoNaturalDeathProb",
+)
+
+
+def model_parameters(model):
+    """
+    The constructor arguments of model that are not derived from its
+    populations. initHumanInfected only matters for the initial population
+    and is not stored by the models.
+    """
+    parameters = {name: getattr(model, name) for name in PARAMETERS}
+    parameters["immuntiyPeriod"] = model.immunityPeriod
+    return parameters
+
+
+def save(model, path):
+    """
+    Writes the state of model (a malaria_skeleton.Model or
+    malaria_vectorized.VectorizedModel) to the directory path: the agent
+    arrays of model.checkpoint_arrays(), the parameters, the counters and
+    the state of the random generator. The checkpoint is written next to
+    path first and then moved in place, so a run killed while saving keeps
+    its previous checkpoint.
+    """
+    path = os.fspath(path)
+    temporary = path + ".tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+
+    arrays = model.checkpoint_arrays()
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, name + ".npy"), array)
+
+    bitGenerator = model.rng.bit_generator
+    metadata = {
+        "model": type(model).__name__,
+        "parameters": model_parameters(model),
+        "counters": {name: int(getattr(model, name)) for name in COUNTERS},
+        "freeCellCount": int(model.freeCells.count),
+        "rng": {"name": type(bitGenerator).__name__, "state": bitGenerator.state},
+    }
+
+    # the key of the common random numbers mode of Model
+    streams = getattr(model, "streams", None)
+    if streams is not None:
+        metadata["crn"] = seed_description(streams.seed)
+
+    with open(os.path.join(temporary, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    if os.path.exists(path):
+        old = path + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(path, old)
+        os.replace(temporary, path)
+        shutil.rmtree(old)
+    else:
+        os.replace(temporary, path)
+
+
+def load(model, path, seed=None, rng=None, mmap=True, **options):
+    """
+    Creates a model of class model from the checkpoint directory path. The
+    run continues exactly where it was saved, unless seed or rng is given:
+    then the continuation draws from that generator instead, so many
+    independent runs can be forked from one checkpoint. With mmap the
+    arrays are memory-mapped copy-on-write, the file is never modified.
+    options are passed on to the constructor (e.g. profile). A Model in
+    the common random numbers mode (crn) keeps its streams, or takes those
+    of seed.
+    """
+    path = os.fspath(path)
+    with open(os.path.join(path, "metadata.json")) as f:
+        metadata = json.load(f)
+    names = [name[:-4] for name in os.listdir(path) if name.endswith(".npy")]
+    arrays = {
+        name: np.load(
+            os.path.join(path, name + ".npy"), mmap_mode="c" if mmap else None
+        )
+        for name in names
+    }
+
+    if rng is None and seed is None:
+        bitGenerator = getattr(np.random, metadata["rng"]["name"])()
+        bitGenerator.state = metadata["rng"]["state"]
+        rng = np.random.Generator(bitGenerator)
+    elif rng is None:
+        rng = np.random.default_rng(seed)
+
+    # a model in the common random numbers mode continues with the streams
+    # of its saved key, or of seed for a fork
+    crn = metadata.get("crn")
+    if crn is not None and seed is None:
+        seed = np.random.SeedSequence(crn["entropy"], spawn_key=crn["spawn_key"])
+    if crn is not None or options.get("crn"):
+        options = dict(options, crn=True, seed=seed)
+
+    # build an empty model and fill in the saved populations
+    sim = model(**metadata["parameters"], nHuman=0, nMosquito=0, **options)
+    sim.rng = sim.freeCells.rng = rng
+    sim.nHuman = arrays["humanX"].size
+    sim.nMosquito = arrays["mosquitoX"].size
+    for name, value in metadata["counters"].items():
+        setattr(sim, name, value)
+
+    sim.freeCells.cells = arrays["freeCells"]
+    sim.freeCells.slot = np.empty_like(sim.freeCells.cells)
+    sim.freeCells.slot[sim.freeCells.cells] = np.arange(sim.freeCells.cells.size)
+    sim.freeCells.count = metadata["freeCellCount"]
+
+    sim.humanGrid.fill(-1)
+    sim.humanGrid[arrays["humanX"], arrays["humanY"]] = np.arange(sim.nHuman)
+    sim.restore_arrays(arrays)
+    return sim
@@ -0,0 +1,160 @@
+import numpy as np
+
+
+def batch_means(series, batch=5):
+    """
+    Means of consecutive non-overlapping batches of batch values of series.
+    A last incomplete batch is dropped.
+    """
+    series = np.asarray(series, dtype=float)
+    n = series.size // batch
+    return series[: n * batch].reshape(n, batch).mean(axis=1)
+
+
+def mser(values):
+    """
+    MSER truncation index of values: the number of leading values to drop
+    so that the squared standard error of the mean of the rest is minimal.
+    Only the first half is considered as truncation, as in the MSER rule
+    of White (1997).
+    """
+    values = np.asarray(values, dtype=float)
+    if values.size < 2:
+        return 0
+
+    # sums over the suffixes values[d:] for every d
+    sums = np.cumsum(values[::-1])[::-1]
+    squares = np.cumsum(values[::-1] ** 2)[::-1]
+    d = np.arange(values.size // 2 + 1)
+    k = values.size - d
+    statistic = (squares[d] - sums[d] ** 2 / k) / k**2
+    return int(np.argmin(statistic))
+
+
+def truncation_point(series, batch=5):
+    """
+    Length of the initial transient of series, in steps, by the MSER-5 rule
+    (MSER on batch means of batch steps).
+    """
+    return batch * mser(batch_means(series, batch))
+
+
+def stable_statistics(series, batch=5):
+    """
+    Mean and standard deviation of series after the MSER transient, and the
+    truncation point in steps.
+    """
+    series = np.asarray(series, dtype=float)
+    cutoff = truncation_point(series, batch)
+    stable = series[cutoff:]
+    return np.mean(stable), np.std(stable), cutoff
+
+
+class SteadyStateDetector:
+    def __init__(self, batch=5, precision=None, minSteps=100, groups=20, z=1.96):
+        """
+        Streaming detection of the steady state of a series, e.g. the
+        infection fraction returned by Model.update. Values are folded in
+        with add(); only the sum and the sum of squares of every batch of
+        batch values are kept, so the transient can be re-estimated with
+        the MSER-5 rule at any time.
+
+        With precision, converged becomes True once at least minSteps
+        values follow the transient and the half width of the z confidence
+        interval of the stable mean is at most precision. The interval is
+        estimated by the method of batch means: the stable batches are
+        grouped into groups large batches which are treated as independent.
+        As a guard against a transient that is still decaying, the means of
+        the two halves of the stable part must also agree within precision.
+        """
+        self.batch = batch
+        self.precision = precision
+        self.minSteps = minSteps
+        self.groups = groups
+        self.z = z
+
+        self.count = 0
+        self.batchSum = 0.0
+        self.batchSquares = 0.0
+        self.sums = []
+        self.squares = []
+        self.checked = -1
+        self.result = None
+
+    def add(self, x):
+        """
+        Fold the next value of the series in.
+        """
+        x = float(x)
+        self.count += 1
+        self.batchSum += x
+        self.batchSquares += x * x
+        if self.count % self.batch == 0:
+            self.sums.append(self.batchSum)
+            self.squares.append(self.batchSquares)
+            self.batchSum = 0.0
+            self.batchSquares = 0.0
+
+    def statistics(self):
+        """
+        Dictionary with the transient length ("cutoff", in steps) and the
+        length ("steps"), mean, standard deviation, confidence half width
+        and drift (difference of the means of its halves) of the stable
+        part. Only recomputed when a batch was completed since the last
+        call.
+        """
+        if self.checked == len(self.sums):
+            return self.result
+        self.checked = len(self.sums)
+
+        sums = np.array(self.sums)
+        squares = np.array(self.squares)
+        start = mser(sums / self.batch)
+        n = (sums.size - start) * self.batch
+
+        result = {"cutoff": start * self.batch, "steps": n}
+        if n == 0:
+            result.update(mean=np.nan, std=np.nan, halfwidth=np.inf, drift=np.inf)
+            self.result = result
+            return result
+
+        mean = sums[start:].sum() / n
+        variance = max(squares[start:].sum() / n - mean**2, 0.0)
+
+        # confidence interval of the mean by the method of batch means
+        means = sums[start:] / self.batch
+        groups = min(self.groups, means.size)
+        halfwidth = np.inf
+        if groups >= 2:
+            size = means.size // groups
+            groupMeans = means[-groups * size :].reshape(groups, size).mean(axis=1)
+            halfwidth = self.z * np.std(groupMeans, ddof=1) / np.sqrt(groups)
+
+        # difference between the means of the two halves of the stable part
+        half = means.size // 2
+        drift = abs(means[:half].mean() - means[half:].mean()) if half else np.inf
+
+        result.update(
+            mean=mean, std=np.sqrt(variance), halfwidth=halfwidth, drift=drift
+        )
+        self.result = result
+        return result
+
+    @property
+    def cutoff(self):
+        return self.statistics()["cutoff"]
+
+    @property
+    def converged(self):
+        """
+        Whether the stable mean is known to the requested precision. Always
+        False without precision.
+        """
+        if self.precision is None or self.count < self.minSteps:
+            return False
+        result = self.statistics()
+        return (
+            result["steps"] >= self.minSteps
+            and result["halfwidth"] <= self.precision
+            and result["drift"] <= self.precision
+        )
@@ -0,0 +1,783 @@
+import hashlib
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+import malaria_checkpoint
+from malaria_profile import StepProfiler
+
+"""
+Headless core of the agent model: Model, its agents and the run loop. Only
+depends on NumPy, so simulation workers can import it without loading
+matplotlib or pandas. malaria_skeleton re-exports everything and adds the
+script with the visualization and the plots.
+"""
+
+"""
+Integer codes of the human states, as used by malaria_vectorized.
+"""
+HUMAN_STATES = {"S": 0, "I": 1, "Immune": 2}
+
+"""
+Names of the values returned by Model.update, in order.
+"""
+COLUMNS = (
+    "infection_fraction",
+    "mosquito_infection_fraction",
+    "death_count",
+    "mosquito_death_count",
+    "immunity_fraction",
+)
+
+
+"""
+Default parameter values of Model, for the code that takes the parameters
+as a dictionary (BatchedModel, the mean-field surrogate).
+"""
+DEFAULTS = dict(
+    width=50,
+    height=50,
+    nHuman=10,
+    nMosquito=20,
+    initMosquitoHungry=0.5,
+    initMosquitoInfected=0.2,
+    initHumanInfected=0.2,
+    humanInfectionProb=0.25,
+    mosquitoInfectionProb=0.9,
+    humanDeathByInfectionProb=0.3,
+    biteProb=1.0,
+    mealInterval=5,
+    infectionPeriod=3,
+    immuntiyPeriod=10,
+    humanNaturalDeathProb=0.001,
+    mosquitoNaturalDeathProb=0.1,
+)
+
+
+"""
+Events with their own random stream in the common random numbers mode of
+Model, see CommonRandomNumbers.
+"""
+MOVE, MOSQUITO_ROLLS, HUMAN_ROLLS, RESPAWN, REBIRTH = range(5)
+
+
+class StepRecord(namedtuple("StepRecord", ("t",) + COLUMNS)):
+    """
+    Statistics of timestep t as returned by Model.update, yielded by
+    run_model and passed to its observers.
+    """
+
+    __slots__ = ()
+
+    @property
+    def data(self):
+        """
+        The statistics without t, as returned by Model.update.
+        """
+        return tuple(self)[1:]
+
+
+class Observer:
+    def __init__(self, function, every=1):
+        """
+        Function of a StepRecord that run_model calls for the timesteps t
+        with t % every == 0, e.g. a recorder every step and a visualization
+        every 100 steps.
+        """
+        self.function = function
+        self.every = every
+
+    def __call__(self, record):
+        return self.function(record)
+
+
+def run_model(model, steps, every=1, observers=(), start=0):
+    """
+    Generator that advances model (a Model or any engine with advance and
+    statistics methods) steps timesteps, numbered from start, and yields
+    the StepRecord of every timestep t with t % every == 0. With every=None
+    nothing is yielded and the records only go to the observers; the
+    generator must still be iterated to run the model.
+
+    observers are Observer objects or plain functions of a StepRecord,
+    which are called every timestep. The due observers are called before
+    the record is yielded. The statistics of a timestep are only collected
+    when it is yielded or observed, other timesteps only advance the model.
+    """
+    observers = [o if isinstance(o, Observer) else Observer(o) for o in observers]
+    for t in range(start, start + steps):
+        model.advance()
+        due = [o for o in observers if t % o.every == 0]
+        yielded = every is not None and t % every == 0
+        if not (due or yielded):
+            continue
+
+        record = StepRecord(t, *model.statistics())
+        for observer in due:
+            observer(record)
+        if yielded:
+            yield record
+
+
+def spawn_seeds(seed, n):
+    """
+    n independent child seeds of seed, which is None, an int or a
+    numpy.random.SeedSequence.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n)
+
+
+def keyed_seed(seed, *keys):
+    """
+    Child seed of seed (a numpy.random.SeedSequence) identified by keys
+    instead of by its position in a spawn() call, so the child of e.g. a
+    sweep value does not change when other values are added. The keys are
+    hashed through their repr, with NumPy scalars taken as the equal Python
+    scalars, so np.float64(0.01) (e.g. from np.linspace) and 0.01 give the
+    same child.
+    """
+    keys = [key.item() if isinstance(key, np.generic) else key for key in keys]
+    words = tuple(
+        int.from_bytes(hashlib.sha256(repr(key).encode()).digest()[:4], "little")
+        for key in keys
+    )
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + words)
+
+
+class CommonRandomNumbers:
+    def __init__(self, seed=None):
+        """
+        Counter-based random streams for the common random numbers mode of
+        Model. The numbers of an event (MOVE, ...) of an agent in a
+        timestep come from a Philox generator keyed by seed (an int or a
+        numpy.random.SeedSequence) whose counter starts at (0, agent,
+        event, step). They only depend on the seed, the step, the event and
+        the agent, not on what was drawn before, so two runs with the same
+        seed and different parameters give every agent the same moves and
+        rolls, and diverge only through the parameter change.
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed = seed
+        self.bitGenerator = np.random.Philox(key=seed.generate_state(2, np.uint64))
+        self.rng = np.random.Generator(self.bitGenerator)
+        self.state = self.bitGenerator.state
+
+    def generator(self, step, event, agent=0):
+        """
+        Generator at the start of the stream of (step, event, agent). The
+        same Generator is repositioned for every stream (which is much
+        cheaper than creating one), so its numbers must be drawn before the
+        next call.
+        """
+        self.state["state"]["counter"][:] = (0, agent, event, step)
+        self.state["buffer_pos"] = 4
+        self.state["has_uint32"] = 0
+        self.bitGenerator.state = self.state
+        return self.rng
+
+
+class Model:
+    def __init__(
+        self,
+        width=50,
+        height=50,
+        nHuman=10,
+        nMosquito=20,
+        initMosquitoHungry=0.5,
+        initMosquitoInfected=0.2,
+        initHumanInfected=0.2,
+        humanInfectionProb=0.25,
+        mosquitoInfectionProb=0.9,
+        humanDeathByInfectionProb=0.3,
+        biteProb=1.0,
+        mealInterval=5,
+        infectionPeriod=3,
+        immuntiyPeriod=10,
+        humanNaturalDeathProb=0.001,
+        mosquitoNaturalDeathProb=0.1,
+        seed=None,
+        rng=None,
+        profile=False,
+        crn=False,
+    ):
+        """
+        Model parameters
+        Initialize the model with the width and height parameters.
+        All random numbers are drawn from rng, a numpy.random.Generator. If
+        no rng is given one is created from seed, so runs with the same seed
+        are reproducible.
+        With crn=True (common random numbers) the timesteps draw from the
+        streams of CommonRandomNumbers(seed) instead, one per step, event
+        and agent. Runs with the same seed and populations then share the
+        moves and rolls of every agent, so the difference between e.g. two
+        values of mosquitoNaturalDeathProb is not buried in the noise of
+        unrelated random streams. The initial populations are drawn from
+        rng in both modes.
+        With profile=True the wall time of every phase of update() and the
+        number of bites, infections and respawns are recorded per step in
+        self.profiler (a malaria_profile.StepProfiler).
+        """
+        self.height = height
+        self.width = width
+        self.nHuman = nHuman
+        self.nMosquito = nMosquito
+        self.initMosquitoHungry = initMosquitoHungry
+        self.initMosquitoInfected = initMosquitoInfected
+        self.humanInfectionProb = humanInfectionProb
+        self.mosquitoInfectionProb = mosquitoInfectionProb
+        self.humanDeathByInfectionProb = humanDeathByInfectionProb
+        self.biteProb = biteProb
+        self.mealInterval = mealInterval
+        self.infectionPeriod = infectionPeriod
+        self.immunityPeriod = immuntiyPeriod
+        self.humanNaturalDeathProb = humanNaturalDeathProb
+        self.mosquitoNaturalDeathProb = mosquitoNaturalDeathProb
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self.profiler = StepProfiler() if profile else None
+        self.streams = CommonRandomNumbers(seed) if crn else None
+        self.step = 0
+        # etc.
+
+        """
+        Data parameters
+        To record the evolution of the model
+        """
+        self.infectedCount = 0
+        self.deathCount = 0
+        self.mosquitoDeathCount = 0
+        self.immunityCount = 0
+        self.mosquitoInfectedCount = 0
+        # etc.
+
+        """
+        Population setters
+        Make a data structure in this case a list with the humans and mosquitos.
+        """
+        self.humanPopulation = self.set_human_population(initHumanInfected)
+        self.mosquitoPopulation = self.set_mosquito_population(
+            initMosquitoHungry, initMosquitoInfected
+        )
+
+    def set_human_population(self, initHumanInfected):
+        """
+        This function makes the initial human population, by iteratively adding
+        an object of the Human class to the humanPopulation list.
+        The position of each Human object is randomized. A number of Human
+        objects is initialized with the "infected" state.
+        """
+        humanPopulation = []
+
+        # grid index mapping each cell to the index of the human living there,
+        # -1 for an empty cell
+        self.humanGrid = np.full((self.width, self.height), -1, dtype=int)
+
+        """
+        Humans may not have overlapping positions, so they are placed on
+        distinct cells drawn from the pool of free cells.
+        """
+        self.freeCells = FreeCells(self.width, self.height, self.rng)
+        positions = np.column_stack(self.freeCells.take(self.nHuman)).tolist()
+
+        for i in range(self.nHuman):
+            x, y = positions[i]
+
+            # store position
+            self.humanGrid[x, y] = i
+
+            # determine if human is infected or not
+            if (i / self.nHuman) <= initHumanInfected:
+                state = "I"  # I for infected
+            else:
+                state = "S"  # S for susceptible
+
+            # add human instance to list of humans
+            humanPopulation.append(Human(x, y, state))
+
+        return humanPopulation
+
+    def set_mosquito_population(self, initMosquitoHungry, initMosquitoInfected):
+        """
+        This function makes the initial mosquito population, by iteratively
+        adding an object of the Mosquito class to the mosquitoPopulation list.
+        The position of each Mosquito object is randomized.
+        A number of Mosquito objects is initialized with the "hungry" state.
+        """
+        mosquitoPopulation = []
+        positions = self.rng.integers(
+            (self.width, self.height), size=(self.nMosquito, 2)
+        ).tolist()
+        infectionRolls = self.rng.random(self.nMosquito).tolist()
+        for i in range(self.nMosquito):
+            x, y = positions[i]
+            if (i / self.nMosquito) <= initMosquitoHungry:
+                hungry = True
+            else:
+                hungry = False
+
+            # determine if mosquito is infected or not
+            if infectionRolls[i] <= initMosquitoInfected:
+                state = True  # True for infected
+            else:
+                state = False  # False for susceptible
+            mosquitoPopulation.append(Mosquito(x, y, hungry, state))
+        return mosquitoPopulation
+
+    def save_checkpoint(self, path):
+        """
+        Writes the full state of the model (agents, counters, parameters and
+        random generator) to the directory path, see malaria_checkpoint.
+        """
+        malaria_checkpoint.save(self, path)
+
+    @classmethod
+    def load_checkpoint(cls, path, seed=None, rng=None, mmap=True, **options):
+        """
+        Creates a model from a checkpoint written by save_checkpoint (of
+        either engine). Without seed and rng the run continues exactly as
+        the saved one would have, with them it is an independent
+        continuation. See malaria_checkpoint.load.
+        """
+        return malaria_checkpoint.load(cls, path, seed, rng, mmap, **options)
+
+    def checkpoint_arrays(self):
+        """
+        The state of the agents as a dictionary of arrays, in the layout of
+        malaria_vectorized.VectorizedModel.
+        """
+        mosquitos = self.mosquitoPopulation
+        humans = self.humanPopulation
+        return {
+            "mosquitoX": np.array([m.position[0] for m in mosquitos], dtype=int),
+            "mosquitoY": np.array([m.position[1] for m in mosquitos], dtype=int),
+            "mosquitoHungry": np.array([m.hungry for m in mosquitos], dtype=bool),
+            "mosquitoInfected": np.array([m.infected for m in mosquitos], dtype=bool),
+            "mosquitoLastMeal": np.array([m.lastMeal for m in mosquitos], dtype=int),
+            "humanX": np.array([h.position[0] for h in humans], dtype=int),
+            "humanY": np.array([h.position[1] for h in humans], dtype=int),
+            "humanState": np.array(
+                [HUMAN_STATES[h.state] for h in humans],
+                dtype=np.int8,
+            ),
+            "humanLastInfection": np.array(
+                [h.lastInfection for h in humans], dtype=int
+            ),
+            "humanLastImmunity": np.array([h.lastImmunity for h in humans], dtype=int),
+            "freeCells": self.freeCells.cells,
+        }
+
+    def restore_arrays(self, arrays):
+        """
+        Rebuilds the populations from the arrays of checkpoint_arrays.
+        """
+        stateNames = list(HUMAN_STATES)
+        self.mosquitoPopulation = []
+        for x, y, hungry, infected, lastMeal in zip(
+            arrays["mosquitoX"].tolist(),
+            arrays["mosquitoY"].tolist(),
+            arrays["mosquitoHungry"].tolist(),
+            arrays["mosquitoInfected"].tolist(),
+            arrays["mosquitoLastMeal"].tolist(),
+        ):
+            m = Mosquito(x, y, hungry, infected)
+            m.lastMeal = lastMeal
+            self.mosquitoPopulation.append(m)
+
+        self.humanPopulation = []
+        for x, y, state, lastInfection, lastImmunity in zip(
+            arrays["humanX"].tolist(),
+            arrays["humanY"].tolist(),
+            arrays["humanState"].tolist(),
+            arrays["humanLastInfection"].tolist(),
+            arrays["humanLastImmunity"].tolist(),
+        ):
+            h = Human(x, y, stateNames[state])
+            h.lastInfection = lastInfection
+            h.lastImmunity = lastImmunity
+            self.humanPopulation.append(h)
+
+    def bytes_per_agent(self):
+        """
+        Memory of one mosquito and one human in bytes: the agent object,
+        its position list and its reference in the population list. The
+        attribute values are small ints, bools and interned strings shared
+        by all agents. For comparison with
+        VectorizedModel.bytes_per_agent.
+        """
+
+        def size(population):
+            if not population:
+                return 0
+            agent = population[0]
+            return (
+                sys.getsizeof(agent)
+                + sys.getsizeof(agent.position)
+                + sys.getsizeof(population) // max(len(population), 1)
+            )
+
+        return {
+            "mosquito": size(self.mosquitoPopulation),
+            "human": size(self.humanPopulation),
+        }
+
+    def generator(self, event, agent=0):
+        """
+        Generator of the random numbers of event (MOVE, ...) of agent in the
+        current timestep: rng, or the stream of CommonRandomNumbers in the
+        common random numbers mode.
+        """
+        if self.streams is None:
+            return self.rng
+        return self.streams.generator(self.step, event, agent)
+
+    def rebirth_human(self, j):
+        """
+        Replaces human j by a new susceptible human on a random free cell and
+        keeps the grid index in sync with the population.
+        """
+        oldX, oldY = self.humanPopulation[j].position
+        self.humanGrid[oldX, oldY] = -1
+        self.freeCells.release(oldX, oldY)
+
+        (x,), (y,) = self.freeCells.take(1, self.generator(REBIRTH, j)).tolist()
+        self.humanGrid[x, y] = j
+        self.humanPopulation[j] = Human(x, y, state="S")
+
+    def update(self):
+        """
+        Perform one timestep (see advance) and return its statistics (see
+        statistics).
+        """
+        self.advance()
+        return self.statistics()
+
+    def run(self, steps, every=1, observers=(), start=0):
+        """
+        Generator of the StepRecord of every every-th of the next steps
+        timesteps, see run_model.
+        """
+        return run_model(self, steps, every, observers, start)
+
+    def advance(self):
+        """
+        Perform one timestep:
+        1.  Update mosquito population. Move the mosquitos. If a mosquito is
+            hungry it can bite a human with a probability biteProb.
+            Update the hungry state of the mosquitos.
+        2.  Update the human population. If a human dies remove it from the
+            population, and add a replacement human.
+        Every phase loops over the whole population before the next phase
+        starts, so the time spent in each phase can be measured (see
+        profile in __init__).
+        """
+        profiler = self.profiler
+        if profiler:
+            profiler.start()
+
+        """
+        Draw the random numbers of this timestep in blocks: a move and three
+        rolls (bite, infection, death) per mosquito and three rolls
+        (recovery, death by infection, natural death) per human.
+        """
+        moves = self.generator(MOVE).integers(-1, 2, size=(self.nMosquito, 2))
+        moves = moves.tolist()
+        mosquitoRolls = self.generator(MOSQUITO_ROLLS).random((self.nMosquito, 3))
+        mosquitoRolls = mosquitoRolls.tolist()
+        humanRolls = self.generator(HUMAN_ROLLS).random((self.nHuman, 3)).tolist()
+
+        self.mosquitoInfectedCount = 0
+        for i, m in enumerate(self.mosquitoPopulation):
+            m.move(self.height, self.width, *moves[i])
+
+            if m.infected:
+                self.mosquitoInfectedCount += 1
+
+        if profiler:
+            profiler.lap("move")
+
+        # possibly bite the human on the same cell
+        bites = 0
+        humanInfections = 0
+        mosquitoInfections = 0
+        for i, m in enumerate(self.mosquitoPopulation):
+            biteRoll, infectionRoll, deathRoll = mosquitoRolls[i]
+            j = self.humanGrid[m.position[0], m.position[1]]
+            if j >= 0 and m.hungry and biteRoll <= self.biteProb:
+                bites += 1
+                infected = m.infected
+                if m.bite(
+                    self.humanPopulation[j],
+                    self.humanInfectionProb,
+                    self.mosquitoInfectionProb,
+                    infectionRoll,
+                ):
+                    if infected:
+                        humanInfections += 1
+                    else:
+                        mosquitoInfections += 1
+                m.lastMeal = 0
+
+        if profiler:
+            profiler.lap("bite")
+            profiler.count("bites", bites)
+            profiler.count("human_infections", humanInfections)
+            profiler.count("mosquito_infections", mosquitoInfections)
+
+        for m in self.mosquitoPopulation:
+            """
+            Set the hungry state from false to true after a
+            number of time steps has passed.
+            """
+            if not m.hungry:
+                m.lastMeal += 1
+                if (
+                    m.lastMeal > self.mealInterval
+                ):  # they are very punctual, optional: decay rate probability
+                    m.hungry = True
+                    m.lastMeal = 0
+
+        if profiler:
+            profiler.lap("hunger")
+
+        deaths = self.mosquitoDeathCount
+        for i in range(self.nMosquito):
+            if mosquitoRolls[i][2] <= self.mosquitoNaturalDeathProb:
+                """
+                Mosquito dies of natural causes.
+                """
+                self.mosquitoDeathCount += 1
+                # print(f"Mosquito {i}: Naturally Dead!")
+
+                rng = self.generator(RESPAWN, i)
+                x = int(rng.integers(self.width))
+                y = int(rng.integers(self.height))
+                if (i / self.nMosquito) <= self.initMosquitoHungry:
+                    hungry = True
+                else:
+                    hungry = False
+
+                self.mosquitoPopulation[i] = Mosquito(x, y, hungry, False)
+
+        if profiler:
+            profiler.lap("mosquito_death")
+            profiler.count("mosquito_respawns", self.mosquitoDeathCount - deaths)
+
+        deaths = self.deathCount
+        for j, h in enumerate(self.humanPopulation):
+            """
+            update the human population.
+            """
+            recoveryRoll, outcomeRoll, deathRoll = humanRolls[j]
+
+            if h.state == "I":
+                # add infection to the total when human just got infected
+                if h.lastInfection == 0:
+                    self.infectedCount += 1
+                    # print(f"Human {j}: Infected!")
+
+                # end of infection according to normal probability
+                if recoveryRoll <= np.exp(
+                    -((h.lastInfection - self.infectionPeriod) ** 2)
+                    / np.sqrt(self.infectionPeriod)
+                ):
+                    # remove from infection count
+                    self.infectedCount -= 1
+
+                    # human dies or gets immune
+                    if outcomeRoll <= self.humanDeathByInfectionProb:
+                        """
+                        Human dies of infection.
+                        """
+                        self.deathCount += 1
+                        # print(f"Human {j}: Dead!")
+
+                        self.rebirth_human(j)
+
+                    else:
+                        """
+                        Human is immune
+                        """
+                        h.state = "Immune"
+                        # print(f"Human {j}: Immune!")
+                        h.lastImmunity = 0
+                        self.immunityCount += 1
+                else:
+                    # add time to last infection
+                    h.lastInfection += 1
+
+            elif h.state == "Immune":
+                h.lastImmunity += 1
+
+                # also according decay rate probability
+                if recoveryRoll <= np.exp(
+                    -((h.lastImmunity - self.immunityPeriod) ** 2)
+                    / np.sqrt(self.immunityPeriod)
+                ):
+                    self.immunityCount -= 1
+                    h.state = "S"
+                    # print(f"Human {j}: Susceptible!")
+
+        if profiler:
+            profiler.lap("human_recovery")
+
+        for j, h in enumerate(self.humanPopulation):
+            if humanRolls[j][2] <= self.humanNaturalDeathProb:
+                """
+                Human dies of natural causes.
+                """
+                self.deathCount += 1
+                if h.state == "I":
+                    self.infectedCount -= 1
+                elif h.state == "Immune":
+                    self.immunityCount -= 1
+                # print(f"Human {j}: Naturally Dead!")
+
+                # give birth to new human on new free position
+                self.rebirth_human(j)
+
+        if profiler:
+            profiler.lap("human_death")
+            profiler.count("human_rebirths", self.deathCount - deaths)
+            profiler.stop()
+
+        self.step += 1
+
+    def statistics(self):
+        """
+        The statistics of the last timestep, in the order of COLUMNS.
+        """
+        return (
+            self.infectedCount / self.nHuman,
+            self.mosquitoInfectedCount / self.nMosquito,
+            self.deathCount,
+            self.mosquitoDeathCount,
+            self.immunityCount / self.nHuman,
+        )
+
+
+class FreeCells:
+    def __init__(self, width, height, rng):
+        """
+        Pool of the grid cells that are not occupied by a human. The flat
+        cell indices are kept in one array whose first count entries are the
+        free cells, and slot holds the position of every cell in that array.
+        Taking and releasing cells swaps entries across the boundary, so the
+        cost depends on the number of cells moved, not on the grid size or
+        on how full the grid is.
+        """
+        self.height = height
+        self.rng = rng
+        self.cells = rng.permutation(width * height)
+        self.slot = np.empty_like(self.cells)
+        self.slot[self.cells] = np.arange(self.cells.size)
+        self.count = self.cells.size
+
+    def take(self, n, rng=None):
+        """
+        Removes n distinct random free cells from the pool and returns their
+        coordinates as an array of shape (2, n). The cells are drawn from
+        rng, by default the generator of the pool.
+        """
+        rng = rng if rng is not None else self.rng
+        positions = rng.choice(self.count, n, replace=False)
+        cells = self.cells[positions]
+        self.move_to(positions, self.count - n, self.count)
+        self.count -= n
+        return np.stack(np.divmod(cells, self.height))
+
+    def release(self, x, y):
+        """
+        Returns the cells (x, y), scalars or arrays, to the pool.
+        """
+        x = np.asarray(x, dtype=np.int64)
+        cells = np.atleast_1d(x * self.height + np.asarray(y))
+        self.move_to(self.slot[cells], self.count, self.count + cells.size)
+        self.count += cells.size
+
+    def move_to(self, positions, start, stop):
+        """
+        Swaps the entries at positions into the range [start, stop), which
+        must have the same length as positions.
+        """
+        inside = (positions >= start) & (positions < stop)
+        source = positions[~inside]
+        target = np.arange(start, stop)
+        target = target[~np.isin(target, positions[inside])]
+
+        sourceCells = self.cells[source]
+        targetCells = self.cells[target]
+        self.cells[source] = targetCells
+        self.cells[target] = sourceCells
+        self.slot[targetCells] = source
+        self.slot[sourceCells] = target
+
+
+class Mosquito:
+    __slots__ = ("position", "hungry", "infected", "lastMeal")
+
+    def __init__(self, x, y, hungry, state):
+        """
+        Class to model the mosquitos. Each mosquito is initialized with a random
+        position on the grid. Mosquitos can start out hungry or not hungry.
+        All mosquitos are initialized infection free (this can be modified).
+        """
+        self.position = [x, y]
+        self.hungry = hungry
+        self.infected = state
+        self.lastMeal = 0  # time since last meal
+
+    def bite(self, human, humanInfectionProb, mosquitoInfectionProb, roll):
+        """
+        Function that handles the biting. If the mosquito is infected and the
+        target human is susceptible, the human can be infected.
+        If the mosquito is not infected and the target human is infected, the
+        mosquito can be infected.
+        roll is a uniform random number in [0, 1) that decides the infection.
+        After a mosquito bites it is no longer hungry.
+        Returns True if the bite passed on an infection (in either direction).
+        """
+        self.hungry = False
+        if self.infected and human.state == "S":
+            if roll <= humanInfectionProb:
+                human.state = "I"
+                human.lastInfection = 0
+                return True
+        elif not self.infected and human.state == "I":
+            if roll <= mosquitoInfectionProb:
+                self.infected = True
+                return True
+        return False
+
+    def move(self, height, width, deltaX, deltaY):
+        """
+        Moves the mosquito one step in the direction (deltaX, deltaY), each
+        drawn uniformly from -1, 0 and 1 by the model.
+        """
+        """
+        To implement: the mosquitos may not leave the grid. There are two
+                      options:
+                      - fixed boundaries: if the mosquito wants to move off the
+                        grid choose a new valid move.
+                      - periodic boundaries: implement a wrap around i.e. if
+                        y+deltaY > ymax -> y = 0.
+        """
+        self.position[0] = (self.position[0] + deltaX) % width
+        self.position[1] = (self.position[1] + deltaY) % height
+
+
+class Human:
+    __slots__ = ("position", "state", "lastInfection", "lastImmunity")
+
+    def __init__(self, x, y, state):
+        """
+        Class to model the humans. Each human is initialized with a random
+        position on the grid. Humans can start out susceptible or infected
+        (or immune).
+        """
+        self.position = [x, y]
+        self.state = state
+        self.lastInfection = 0  # time since last infection
+        self.lastImmunity = 0  # time since last immunity
@@ -0,0 +1,598 @@
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from malaria_core import FreeCells, run_model, spawn_seeds
+from malaria_vectorized import GRID_INDEX, SUSCEPTIBLE, VectorizedModel
+
+"""
+Commands of the parent to the workers, and the per worker counters in the
+shared statistics array, in order.
+"""
+STEP = 0
+STOP = 1
+STATISTICS = (
+    "infectedCount",
+    "deathCount",
+    "mosquitoDeathCount",
+    "immunityCount",
+    "mosquitoInfectedCount",
+)
+
+"""
+Agent arrays of a worker. The mosquito arrays are also the fields of a
+migrating mosquito in the mailboxes.
+"""
+MOSQUITO_ARRAYS = (
+    "mosquitoX",
+    "mosquitoY",
+    "mosquitoHungry",
+    "mosquitoInfected",
+    "mosquitoLastMeal",
+)
+HUMAN_ARRAYS = (
+    "humanX",
+    "humanY",
+    "humanState",
+    "humanLastInfection",
+    "humanLastImmunity",
+)
+
+
+def create_shared(blocks, name, shape, dtype):
+    """
+    New array of zeros in a shared memory block, stored in blocks under
+    name. Returns the array and the description needed to attach it in
+    another process. A new block is zero filled by the operating system
+    and its pages only take memory once they are written to.
+    """
+    size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    blocks[name] = block
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return array, (block.name, shape, np.dtype(dtype).str)
+
+
+def attach_shared(blocks, name, spec):
+    """
+    Array of a shared memory block made by create_shared in another process.
+    """
+    blockName, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=blockName)
+    blocks[name] = block
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+class Tile(VectorizedModel):
+    """
+    The part of a DecomposedModel simulated by one worker: the strip of
+    columns x0 <= x < x1, the humans living in it and the mosquitos flying
+    over it. Coordinates are local to the strip. The agent arrays are the
+    first entries of buffers in the shared memory blocks of the model. The
+    buffers have room for every mosquito of the model and for a human on
+    every cell of the strip, of which only the pages in use take memory.
+
+    The phases are those of VectorizedModel, except that mosquitos leaving
+    the strip are handed to the neighbouring worker, and that the dead
+    mosquitos and humans are replaced on random cells of the whole grid.
+    The workers publish how many agents died and draw from a random stream
+    they share (common) how many of the replacements land in every strip,
+    so each worker adds its own share.
+    """
+
+    def set_human_population(self, initHumanInfected):
+        pass
+
+    def set_mosquito_population(self, initMosquitoHungry, initMosquitoInfected):
+        pass
+
+    def attach(self, worker, workers, bounds, arrays, exchange, common):
+        """
+        Takes over the shared arrays of the strip of worker. exchange is the
+        barrier of the workers between sending and receiving agents, common
+        the random generator that all workers draw the same numbers from.
+        """
+        self.worker = worker
+        self.workers = workers
+        self.x0, self.x1 = int(bounds[worker]), int(bounds[worker + 1])
+        self.stripShare = np.diff(bounds) / bounds[-1]
+        self.width = self.x1 - self.x0
+        self.arrays = arrays
+        self.exchange = exchange
+        self.common = common
+
+        self.humanBuffers = {name: arrays[name][worker] for name in HUMAN_ARRAYS}
+        self.set_human_count(int(arrays["humanCounts"][worker]))
+        self.humanGrid = arrays["humanGrid"][self.x0 : self.x1]
+
+        # pool of the free cells of the strip
+        self.freeCells = FreeCells(self.width, self.height, self.rng)
+        taken = self.freeCells.slot[self.humanX.astype(int) * self.height + self.humanY]
+        self.freeCells.move_to(
+            taken, self.freeCells.count - self.nHuman, self.freeCells.count
+        )
+        self.freeCells.count -= self.nHuman
+
+        self.buffers = {name: arrays[name][worker] for name in MOSQUITO_ARRAYS}
+        self.set_mosquito_count(int(arrays["mosquitoCounts"][worker]))
+
+    def set_mosquito_count(self, n):
+        """
+        Points the mosquito arrays at the first n entries of the buffers.
+        """
+        self.nMosquito = n
+        self.arrays["mosquitoCounts"][self.worker] = n
+        for name, buffer in self.buffers.items():
+            setattr(self, name, buffer[:n])
+
+    def set_human_count(self, n):
+        """
+        Points the human arrays at the first n entries of the buffers.
+        """
+        self.nHuman = n
+        self.arrays["humanCounts"][self.worker] = n
+        for name, buffer in self.humanBuffers.items():
+            setattr(self, name, buffer[:n])
+
+    def compact(self, buffers, keep):
+        """
+        Moves the entries of the agents keep (a mask of the current agents)
+        to the start of buffers and returns their number.
+        """
+        n = int(np.count_nonzero(keep))
+        for name, buffer in buffers.items():
+            buffer[:n] = getattr(self, name)[keep]
+        return n
+
+    def move_mosquitoes(self):
+        """
+        Moves the mosquitos like VectorizedModel.move_mosquitoes and hands
+        the ones leaving the strip to the neighbouring workers (with
+        periodic boundaries). Only mosquitos on an edge column can leave,
+        the mailboxes hold inboxSize of them per side and more are sent in
+        further rounds, until no worker has migrants left.
+        """
+        delta = self.rng.integers(-1, 2, size=(2, self.nMosquito))
+        x = self.mosquitoX.astype(np.int64) + delta[0]
+        self.mosquitoY[:] = (self.mosquitoY + delta[1]) % self.height
+
+        # the x of the leaving ones is set when they arrive
+        toLeft = x < 0
+        toRight = x >= self.width
+        self.mosquitoX[:] = x % self.width
+        outgoing = [
+            {name: getattr(self, name)[leaving] for name in MOSQUITO_ARRAYS}
+            for leaving in (toRight, toLeft)
+        ]
+        n = self.compact(self.buffers, ~(toLeft | toRight))
+
+        # inbox[worker, 0] holds the mosquitos arriving from the left
+        # neighbour, inbox[worker, 1] the ones arriving from the right
+        inboxCounts = self.arrays["inboxCounts"]
+        pending = self.arrays["pending"]
+        targets = ((self.worker + 1) % self.workers, (self.worker - 1) % self.workers)
+        sent = 0
+        while True:
+            remaining = 0
+            for side, target in enumerate(targets):
+                fields = outgoing[side]
+                m = min(fields["mosquitoX"].size - sent, self.inboxSize)
+                m = max(m, 0)
+                for name in MOSQUITO_ARRAYS:
+                    self.arrays["inbox/" + name][target, side, :m] = fields[name][
+                        sent : sent + m
+                    ]
+                inboxCounts[target, side] = m
+                remaining += max(fields["mosquitoX"].size - sent - m, 0)
+            pending[self.worker] = remaining
+            sent += self.inboxSize
+
+            self.exchange.wait()
+
+            for side in (0, 1):
+                m = int(inboxCounts[self.worker, side])
+                for name, buffer in self.buffers.items():
+                    buffer[n : n + m] = self.arrays["inbox/" + name][
+                        self.worker, side, :m
+                    ]
+
+                # mosquitos from the left enter at the left edge of the strip,
+                # the ones from the right at the right edge
+                self.buffers["mosquitoX"][n : n + m] = (
+                    0 if side == 0 else self.width - 1
+                )
+                n += m
+
+            # everyone reads pending before it is written again
+            if not pending.any():
+                break
+            self.exchange.wait()
+        self.set_mosquito_count(n)
+
+    def respawn_mosquitoes(self, dead):
+        """
+        Removes the dead mosquitos and adds this strip's share of the
+        replacements of all strips, non-infected mosquitos on uniformly
+        random cells of the whole grid (see VectorizedModel.respawn_mosquitoes).
+        """
+        hungry = self.respawn_hungry(dead)
+        respawns = self.arrays["respawns"]
+        respawns[self.worker] = np.count_nonzero(hungry), dead.size
+        keep = np.ones(self.nMosquito, dtype=bool)
+        keep[dead] = False
+        n = self.compact(self.buffers, keep)
+
+        self.exchange.wait()
+
+        # hungry and sated replacements go to the strips in proportion to
+        # their width, the same draws in every worker
+        nHungry, nDead = respawns.sum(axis=0).tolist()
+        hungryShare = self.common.multinomial(nHungry, self.stripShare)
+        satedShare = self.common.multinomial(nDead - nHungry, self.stripShare)
+        m = int(hungryShare[self.worker] + satedShare[self.worker])
+
+        new = slice(n, n + m)
+        self.buffers["mosquitoX"][new] = self.rng.integers(self.width, size=m)
+        self.buffers["mosquitoY"][new] = self.rng.integers(self.height, size=m)
+        self.buffers["mosquitoHungry"][new] = np.arange(m) < hungryShare[self.worker]
+        self.buffers["mosquitoInfected"][new] = False
+        self.buffers["mosquitoLastMeal"][new] = 0
+        self.set_mosquito_count(n + m)
+
+    def rebirth_humans(self, index):
+        """
+        Removes the dead humans and adds this strip's share of the
+        susceptible humans replacing the dead of all strips. The reborn
+        humans take distinct free cells of the whole grid, the number
+        landing in every strip is drawn from the free cells of the strips.
+        """
+        if self.profiler:
+            self.profiler.count("human_rebirths", index.size)
+
+        self.humanGrid[self.humanX[index], self.humanY[index]] = -1
+        self.freeCells.release(self.humanX[index], self.humanY[index])
+        keep = np.ones(self.nHuman, dtype=bool)
+        keep[index] = False
+        n = self.compact(self.humanBuffers, keep)
+        if index.size:
+            self.set_human_count(n)
+            self.humanGrid[self.humanX, self.humanY] = np.arange(n)
+
+        rebirths = self.arrays["rebirths"]
+        freeCounts = self.arrays["freeCounts"]
+        rebirths[self.worker] = index.size
+        freeCounts[self.worker] = self.freeCells.count
+
+        self.exchange.wait()
+
+        share = self.common.multivariate_hypergeometric(
+            freeCounts.copy(), int(rebirths.sum())
+        )
+        m = int(share[self.worker])
+        if m:
+            new = slice(n, n + m)
+            x, y = self.freeCells.take(m)
+            self.humanBuffers["humanX"][new] = x
+            self.humanBuffers["humanY"][new] = y
+            self.humanBuffers["humanState"][new] = SUSCEPTIBLE
+            self.humanBuffers["humanLastInfection"][new] = 0
+            self.humanBuffers["humanLastImmunity"][new] = 0
+            self.humanGrid[x, y] = np.arange(n, n + m)
+        self.set_human_count(n + m)
+
+
+def run_worker(
+    worker, workers, bounds, parameters, seed, commonSeed, inboxSize, specs, barriers
+):
+    """
+    Main loop of a worker process: waits for the parent to start a step,
+    performs it on its Tile and publishes the counters of the strip.
+    """
+    start, done, exchange = barriers
+    blocks = dict()
+    arrays = dict()
+    tile = None
+    try:
+        for name, spec in specs.items():
+            arrays[name] = attach_shared(blocks, name, spec)
+        tile = Tile(**dict(parameters, nHuman=0, nMosquito=0), seed=seed)
+        tile.inboxSize = inboxSize
+        common = np.random.default_rng(commonSeed)
+        tile.attach(worker, workers, bounds, arrays, exchange, common)
+
+        # tell the parent that the worker is ready
+        done.wait()
+        while True:
+            start.wait()
+            if arrays["command"][0] == STOP:
+                break
+            tile.advance()
+            arrays["statistics"][worker] = [getattr(tile, name) for name in STATISTICS]
+            done.wait()
+    except threading.BrokenBarrierError:
+        pass
+    except BaseException:
+        for barrier in barriers:
+            barrier.abort()
+        raise
+    finally:
+        # the views must be gone before the blocks can be closed
+        tile = None
+        arrays.clear()
+        for block in blocks.values():
+            block.close()
+
+
+class DecomposedModel:
+    def __init__(
+        self, workers=None, seed=None, rng=None, startTimeout=60, **parameters
+    ):
+        """
+        Model whose grid is split into strips of columns, each simulated by
+        its own worker process, so a single large simulation uses all
+        cores. parameters are those of malaria_skeleton.Model, and update()
+        returns the same tuple, aggregated over the strips. workers is the
+        number of processes (None uses all cores, at most one per column).
+        The workers must have started within startTimeout seconds.
+
+        The initial populations are placed by a VectorizedModel, so they
+        are distributed exactly as in the single process engines. The agent
+        arrays live in shared memory blocks, and every step the mosquitos
+        that fly over a strip border (including the periodic wraparound)
+        are handed to the neighbouring worker through shared mailboxes of
+        a few edge columns' worth of mosquitos. Dead mosquitos respawn and
+        dead humans are reborn on random (free) cells of the whole grid,
+        with the same distributions as in VectorizedModel, see Tile.
+
+        Call close() (or use the model as a context manager) to stop the
+        workers and free the shared memory.
+        """
+        if rng is not None:
+            seed = int(rng.integers(2**63))
+        initialSeed, workerSeed, commonSeed = spawn_seeds(seed, 3)
+        initial = VectorizedModel(**parameters, seed=initialSeed)
+
+        self.width = initial.width
+        self.height = initial.height
+        self.nHuman = initial.nHuman
+        self.nMosquito = initial.nMosquito
+        self.workers = max(min(workers or os.cpu_count(), self.width), 1)
+        self.bounds = np.linspace(0, self.width, self.workers + 1).astype(int)
+
+        self.blocks = dict()
+        self.arrays = dict()
+        self.specs = dict()
+
+        """
+        Every worker keeps its agents at the start of its row of the agent
+        buffers, with x relative to its strip, and the number of them in
+        humanCounts and mosquitoCounts. humanGrid holds the index of a human
+        within its strip. The mosquito buffers have room for all mosquitos
+        and the human buffers for a human on every cell of the widest
+        strip; only the pages that are written to take memory.
+        """
+        stripWidth = int(np.diff(self.bounds).max())
+        humanCapacity = max(min(self.nHuman, stripWidth * self.height), 1)
+        humanGrid = self.shared("humanGrid", (self.width, self.height), GRID_INDEX)
+        humanGrid.fill(-1)
+        self.distribute(initial, HUMAN_ARRAYS, "humanCounts", humanCapacity)
+        for worker in range(self.workers):
+            x = self.agent_array("humanX", "humanCounts", worker)
+            y = self.arrays["humanY"][worker, : x.size]
+            humanGrid[x, y] = np.arange(x.size)
+        self.distribute(initial, MOSQUITO_ARRAYS, "mosquitoCounts", self.nMosquito)
+
+        """
+        Mailboxes of the migrating mosquitos, per receiving worker and side
+        in the dtypes of the mosquito arrays. Only the mosquitos on an edge
+        column can leave a strip, the boxes take twice the mean number of
+        mosquitos on a column (more migrants are sent in further rounds).
+        """
+        self.inboxSize = max(min(self.nMosquito, 2 * self.nMosquito // self.width), 64)
+        for name in MOSQUITO_ARRAYS:
+            self.shared(
+                "inbox/" + name,
+                (self.workers, 2, self.inboxSize),
+                getattr(initial, name).dtype,
+            )
+        self.shared("inboxCounts", (self.workers, 2), np.int64)
+        self.shared("pending", (self.workers,), np.int64)
+        self.shared("respawns", (self.workers, 2), np.int64)
+        self.shared("rebirths", (self.workers,), np.int64)
+        self.shared("freeCounts", (self.workers,), np.int64)
+        self.shared("statistics", (self.workers, len(STATISTICS)), np.int64)
+        self.shared("command", (1,), np.int64)
+
+        context = multiprocessing.get_context()
+        self.start = context.Barrier(self.workers + 1)
+        self.done = context.Barrier(self.workers + 1)
+        self.barriers = (self.start, self.done, context.Barrier(self.workers))
+        parameters = dict(parameters, width=self.width, height=self.height)
+        self.processes = [
+            context.Process(
+                target=run_worker,
+                args=(
+                    worker,
+                    self.workers,
+                    self.bounds,
+                    parameters,
+                    seed,
+                    commonSeed,
+                    self.inboxSize,
+                    self.specs,
+                    self.barriers,
+                ),
+                daemon=True,
+            )
+            for worker, seed in enumerate(spawn_seeds(workerSeed, self.workers))
+        ]
+        for process in self.processes:
+            process.start()
+        self.closed = False
+
+        # wait until every worker is attached to the shared memory
+        try:
+            self.done.wait(timeout=startTimeout)
+        except threading.BrokenBarrierError:
+            self.close()
+            raise RuntimeError("the workers of the DecomposedModel did not start")
+
+    def update(self):
+        """
+        Perform one timestep in all strips and return the statistics of the
+        whole model, see Model.update.
+        """
+        self.advance()
+        return self.statistics()
+
+    def run(self, steps, every=1, observers=(), start=0):
+        """
+        Generator of the StepRecord of every every-th of the next steps
+        timesteps, see malaria_skeleton.run_model.
+        """
+        return run_model(self, steps, every, observers, start)
+
+    def advance(self):
+        """
+        Perform one timestep in all strips. The statistics of the strips
+        are left in the shared statistics array.
+        """
+        if self.closed:
+            raise RuntimeError("the model is closed")
+        self.arrays["command"][0] = STEP
+        try:
+            self.start.wait()
+            self.done.wait()
+        except threading.BrokenBarrierError:
+            self.close()
+            raise RuntimeError("a worker of the DecomposedModel failed")
+
+    def statistics(self):
+        """
+        The statistics of the whole model in the last timestep, the sums
+        over the strips.
+        """
+        infected, deaths, mosquitoDeaths, immune, mosquitoInfected = (
+            self.arrays["statistics"].sum(axis=0).tolist()
+        )
+        return (
+            infected / self.nHuman,
+            mosquitoInfected / self.nMosquito,
+            deaths,
+            mosquitoDeaths,
+            immune / self.nHuman,
+        )
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.arrays["command"][0] = STOP
+        try:
+            self.start.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def shared(self, name, shape, dtype):
+        """
+        New shared array of zeros, see create_shared, in arrays[name].
+        """
+        self.arrays[name], self.specs[name] = create_shared(
+            self.blocks, name, shape, dtype
+        )
+        return self.arrays[name]
+
+    def distribute(self, initial, names, countName, capacity):
+        """
+        Copies the agent arrays names of the VectorizedModel initial into
+        shared buffers of shape (workers, capacity), every agent to the row
+        of the strip it is in, and their numbers into the shared array
+        countName.
+        """
+        strip = np.searchsorted(self.bounds, getattr(initial, names[0]), "right") - 1
+        counts = self.shared(countName, (self.workers,), np.int64)
+        counts[:] = np.bincount(strip, minlength=self.workers)
+        for name in names:
+            values = getattr(initial, name)
+            buffer = self.shared(name, (self.workers, capacity), values.dtype)
+            for worker in range(self.workers):
+                inStrip = values[strip == worker]
+                if name in ("mosquitoX", "humanX"):
+                    inStrip = inStrip - self.bounds[worker]
+                buffer[worker, : inStrip.size] = inStrip
+
+    """
+    The agents in grid coordinates, e.g. for the visualization. Every
+    access builds new arrays.
+    """
+
+    def agent_array(self, name, countName, worker):
+        """
+        The name array of the agents of worker, x in grid coordinates.
+        """
+        part = self.arrays[name][worker, : self.arrays[countName][worker]]
+        if name in ("mosquitoX", "humanX"):
+            part = part + self.bounds[worker]
+        return part
+
+    def mosquito_array(self, name):
+        return np.concatenate(
+            [
+                self.agent_array(name, "mosquitoCounts", worker)
+                for worker in range(self.workers)
+            ]
+        )
+
+    def human_array(self, name):
+        return np.concatenate(
+            [
+                self.agent_array(name, "humanCounts", worker)
+                for worker in range(self.workers)
+            ]
+        )
+
+    @property
+    def mosquitoX(self):
+        return self.mosquito_array("mosquitoX")
+
+    @property
+    def mosquitoY(self):
+        return self.mosquito_array("mosquitoY")
+
+    @property
+    def mosquitoInfected(self):
+        return self.mosquito_array("mosquitoInfected")
+
+    @property
+    def humanX(self):
+        return self.human_array("humanX")
+
+    @property
+    def humanY(self):
+        return self.human_array("humanY")
+
+    @property
+    def humanState(self):
+        return self.human_array("humanState")
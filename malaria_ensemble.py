@@ -0,0 +1,257 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from malaria_core import COLUMNS, spawn_seeds
+from malaria_vectorized import VectorizedModel
+
+
+class RunningStatistics:
+    def __init__(self, shape):
+        """
+        Streaming mean and variance (Welford's algorithm) of arrays of the
+        given shape. Observations are folded in one at a time, only the
+        count, mean and sum of squared deviations are stored.
+        """
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, x):
+        """
+        Fold one observation (an array of the accumulator's shape) in.
+        """
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        """
+        Sample variance, nan while fewer than two observations were added.
+        """
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """
+        Standard error of the mean.
+        """
+        return self.std / np.sqrt(self.count)
+
+
+class RunningQuantile:
+    def __init__(self, shape, p):
+        """
+        Streaming estimate of the p-quantile of arrays of the given shape,
+        using the P-square algorithm of Jain and Chlamtac (1985). Every
+        element keeps five markers, so memory does not grow with the number
+        of observations.
+        """
+        self.p = p
+        self.count = 0
+        self.q = np.zeros(shape + (5,))
+        self.n = np.tile(np.arange(5.0), shape + (1,))
+        self.desired = np.tile(
+            np.array([0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]), shape + (1,)
+        )
+        self.increment = np.array([0.0, p / 2, p, (1 + p) / 2, 1.0])
+
+    def add(self, x):
+        """
+        Fold one observation (an array of the accumulator's shape) in.
+        """
+        x = np.asarray(x, dtype=float)
+
+        # the first five observations become the initial markers
+        if self.count < 5:
+            self.q[..., self.count] = x
+            self.count += 1
+            if self.count == 5:
+                self.q.sort(axis=-1)
+            return
+        self.count += 1
+
+        q, n = self.q, self.n
+
+        # find the cell of x and update the extreme markers
+        q[..., 0] = np.minimum(q[..., 0], x)
+        q[..., 4] = np.maximum(q[..., 4], x)
+        k = np.clip((x[..., None] >= q[..., 1:4]).sum(axis=-1), 0, 3)
+
+        # increment the positions of the markers above the cell
+        n += np.arange(5) > k[..., None]
+        self.desired += self.increment
+
+        # adjust the three middle markers
+        for i in range(1, 4):
+            d = self.desired[..., i] - n[..., i]
+            adjust = ((d >= 1) & (n[..., i + 1] - n[..., i] > 1)) | (
+                (d <= -1) & (n[..., i - 1] - n[..., i] < -1)
+            )
+            if not adjust.any():
+                continue
+            d = np.where(adjust, np.sign(d), 0.0)
+
+            qi, ni = q[..., i], n[..., i]
+            qUp, nUp = q[..., i + 1], n[..., i + 1]
+            qDown, nDown = q[..., i - 1], n[..., i - 1]
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                parabolic = qi + d / (nUp - nDown) * (
+                    (ni - nDown + d) * (qUp - qi) / (nUp - ni)
+                    + (nUp - ni - d) * (qi - qDown) / (ni - nDown)
+                )
+                linear = qi + d * np.where(
+                    d > 0, (qUp - qi) / (nUp - ni), (qDown - qi) / (nDown - ni)
+                )
+            new = np.where((qDown < parabolic) & (parabolic < qUp), parabolic, linear)
+
+            q[..., i] = np.where(adjust, new, qi)
+            n[..., i] = ni + d
+
+    @property
+    def value(self):
+        """
+        Current quantile estimate, exact while fewer than five observations
+        were added.
+        """
+        if self.count < 5:
+            if self.count == 0:
+                return np.full(self.q.shape[:-1], np.nan)
+            return np.quantile(self.q[..., : self.count], self.p, axis=-1)
+        return self.q[..., 2].copy()
+
+
+class EnsembleStatistics:
+    def __init__(self, steps, quantiles=(0.05, 0.5, 0.95)):
+        """
+        Per timestep running statistics of the update() output of an
+        ensemble of runs. Memory is O(steps), independent of the number of
+        replicates added.
+        """
+        self.steps = steps
+        self.moments = RunningStatistics((steps, len(COLUMNS)))
+        self.quantiles = {
+            p: RunningQuantile((steps, len(COLUMNS)), p) for p in quantiles
+        }
+
+    def add(self, trajectory):
+        """
+        Fold the trajectory of one replicate, an array of shape
+        (steps, 5) with one update() tuple per row, into the statistics.
+        """
+        trajectory = np.asarray(trajectory, dtype=float)
+        self.moments.add(trajectory)
+        for accumulator in self.quantiles.values():
+            accumulator.add(trajectory)
+
+    @property
+    def replicates(self):
+        return self.moments.count
+
+    def summary(self, column="infection_fraction"):
+        """
+        Dictionary with the mean, std, standard error and quantiles of one
+        output column for every timestep.
+        """
+        c = COLUMNS.index(column)
+        summary = {
+            "t": np.arange(self.steps),
+            "mean": self.moments.mean[:, c],
+            "std": self.moments.std[:, c],
+            "sem": self.moments.sem[:, c],
+        }
+        for p, accumulator in self.quantiles.items():
+            summary[f"q{p:g}"] = accumulator.value[:, c]
+        return summary
+
+
+def simulate_trajectory(model, parameter_values, steps, seed):
+    """
+    Run a single simulation and return its update() tuples as an array of
+    shape (steps, 5). Module level so it can be sent to a worker process.
+    """
+    sim = model(**parameter_values, seed=seed)
+    trajectory = np.empty((steps, len(COLUMNS)))
+    for record in sim.run(steps):
+        trajectory[record.t] = record.data
+    return trajectory
+
+
+def run_ensemble(
+    steps,
+    parameter_values,
+    replicates,
+    model=VectorizedModel,
+    seed=None,
+    quantiles=(0.05, 0.5, 0.95),
+    processes=1,
+):
+    """
+    Run replicates independent simulations of model with the keyword
+    arguments in parameter_values and return their EnsembleStatistics.
+    Every replicate gets its own random stream spawned from seed. Each
+    trajectory is folded into the statistics as soon as it is done and
+    then dropped. With processes other than 1 the replicates run in a pool
+    of worker processes (None uses all cores).
+    """
+    statistics = EnsembleStatistics(steps, quantiles)
+    seeds = spawn_seeds(seed, replicates)
+
+    if processes == 1:
+        for replicate_seed in seeds:
+            statistics.add(
+                simulate_trajectory(model, parameter_values, steps, replicate_seed)
+            )
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            trajectories = pool.map(
+                simulate_trajectory,
+                [model] * replicates,
+                [parameter_values] * replicates,
+                [steps] * replicates,
+                seeds,
+            )
+            for trajectory in trajectories:
+                statistics.add(trajectory)
+
+    return statistics
+
+
+def ensemble_sweep(
+    steps,
+    parameter_values,
+    parameter,
+    values,
+    replicates,
+    model=VectorizedModel,
+    seed=None,
+    quantiles=(0.05, 0.5, 0.95),
+    processes=1,
+):
+    """
+    run_ensemble for every value of parameter. Returns a dictionary mapping
+    str(value) to the EnsembleStatistics of that value.
+    """
+    seeds = spawn_seeds(seed, len(values))
+    results = dict()
+    for value, value_seed in zip(values, seeds):
+        print(f"value = {value}")
+        results[str(value)] = run_ensemble(
+            steps,
+            dict(parameter_values, **{parameter: value}),
+            replicates,
+            model=model,
+            seed=value_seed,
+            quantiles=quantiles,
+            processes=processes,
+        )
+    return results
@@ -0,0 +1,357 @@
+import numpy as np
+
+from malaria_vectorized import (
+    IMMUNE,
+    INFECTED,
+    SUSCEPTIBLE,
+    VectorizedModel,
+    transition_probability,
+)
+
+
+def transition_table(period, firstAge=0):
+    """
+    Cumulative distribution of the age at which an infection (or immunity)
+    ends, for the per-step probability transition_probability(age, period)
+    checked at the ages firstAge, firstAge + 1, ... Entry a is the
+    probability that the transition happened at an age <= a. For an integer
+    period the transition is certain at age period, so the table ends
+    there.
+    """
+    ages = np.arange(int(np.ceil(period)) + 1)
+    hazard = np.where(ages >= firstAge, transition_probability(ages, period), 0.0)
+    survival = np.cumprod(1 - hazard)
+    table = 1 - survival
+    table[-1] = 1.0
+    return table
+
+
+def sample_age(table, rng, n):
+    """
+    Draws n transition ages from a table made by transition_table.
+    """
+    return np.searchsorted(table, rng.random(n), side="right")
+
+
+def sample_remaining_age(table, rng, age):
+    """
+    Draws transition ages from a table made by transition_table, given that
+    the transition did not happen before the ages age (an array).
+    """
+    low = np.where(age > 0, table[np.clip(age - 1, 0, table.size - 1)], 0.0)
+    drawn = np.searchsorted(table, low + (1 - low) * rng.random(age.size), "right")
+    return np.maximum(drawn, age)
+
+
+class Calendar:
+    def __init__(self):
+        """
+        Time-bucketed event queue: maps a step to the agents that have an
+        event scheduled in that step. Entries are not removed when an event
+        is cancelled, the model checks them against its own record of the
+        scheduled step when the bucket is due.
+        """
+        self.buckets = dict()
+
+    def schedule(self, index, steps):
+        """
+        Schedules an event for agent index[i] in step steps[i].
+        """
+        if index.size == 0:
+            return
+        order = np.argsort(steps, kind="stable")
+        index, steps = index[order], steps[order]
+        unique, start = np.unique(steps, return_index=True)
+        for step, group in zip(unique.tolist(), np.split(index, start[1:])):
+            self.buckets.setdefault(step, []).append(group)
+
+    def pop(self, step):
+        """
+        Removes and returns the (unique) agents scheduled for step.
+        """
+        groups = self.buckets.pop(step, None)
+        if not groups:
+            return np.zeros(0, dtype=int)
+        return np.unique(np.concatenate(groups))
+
+
+class EventModel(VectorizedModel):
+    """
+    VectorizedModel in which the rare transitions are scheduled instead of
+    checked every step. When a human becomes infected or immune, the step
+    in which the infection or immunity ends is drawn from a precomputed
+    per-age table of the same bell shaped hazard. A fed mosquito gets the
+    step in which it becomes hungry again, and every human gets the step of
+    its next natural death (geometric). These steps go into Calendar
+    buckets, and each step only touches the agents that are due. Movement,
+    bites and mosquito deaths stay per step.
+
+    The step distributions are exactly those of VectorizedModel.
+    lastMeal, lastInfection and lastImmunity are derived from the scheduled
+    steps when read.
+    """
+
+    mosquitoArrays = (
+        "mosquitoX",
+        "mosquitoY",
+        "mosquitoHungry",
+        "mosquitoInfected",
+        "mosquitoHungryAt",
+    )
+    humanArrays = (
+        "humanX",
+        "humanY",
+        "humanState",
+        "humanEventStep",
+        "humanInfectedAt",
+        "humanImmuneAt",
+        "humanDeathStep",
+    )
+
+    def set_human_population(self, initHumanInfected):
+        # the compiled kernels would bypass the scheduling hooks
+        if self.backend != "numpy":
+            raise ValueError("EventModel only supports the numpy backend")
+        self.newInfections = 0
+        self.infectionTable = transition_table(self.infectionPeriod)
+        self.immunityTable = transition_table(self.immunityPeriod, firstAge=1)
+        self.infectionCalendar = Calendar()
+        self.immunityCalendar = Calendar()
+        self.deathCalendar = Calendar()
+        self.hungerCalendar = Calendar()
+
+        # step of the pending end of infection/immunity of every human
+        self.humanEventStep = np.full(self.nHuman, -1, dtype=int)
+        self.humanInfectedAt = np.zeros(self.nHuman, dtype=int)
+        self.humanImmuneAt = np.zeros(self.nHuman, dtype=int)
+
+        super().set_human_population(initHumanInfected)
+
+        self.infect_humans(np.flatnonzero(self.humanState == INFECTED))
+        self.humanDeathStep = np.zeros(self.nHuman, dtype=int)
+        self.schedule_natural_deaths(np.arange(self.nHuman), 0)
+
+    def set_mosquito_population(self, initMosquitoHungry, initMosquitoInfected):
+        self.mosquitoHungryAt = np.full(self.nMosquito, -1, dtype=int)
+        super().set_mosquito_population(initMosquitoHungry, initMosquitoInfected)
+
+        # the initial sated mosquitos become hungry after mealInterval steps
+        sated = np.flatnonzero(~self.mosquitoHungry)
+        self.mosquitoHungryAt[sated] = self.mealInterval
+        self.hungerCalendar.schedule(sated, self.mosquitoHungryAt[sated])
+
+    def checkpoint_arrays(self):
+        """
+        The agent arrays of VectorizedModel and the scheduled steps of the
+        pending transitions and natural deaths of the humans.
+        """
+        arrays = super().checkpoint_arrays()
+        arrays["humanEventStep"] = self.humanEventStep
+        arrays["humanDeathStep"] = self.humanDeathStep
+        return arrays
+
+    def restore_arrays(self, arrays):
+        """
+        Takes over the agent arrays of a checkpoint and rebuilds the
+        calendars. The checkpoint of another engine has no scheduled steps,
+        they are then drawn from the same distributions, given the current
+        ages of the infections and immunities.
+        """
+        n = arrays["humanX"].size
+        self.humanInfectedAt = np.zeros(n, dtype=int)
+        self.humanImmuneAt = np.zeros(n, dtype=int)
+        self.mosquitoHungryAt = np.full(arrays["mosquitoX"].size, -1, dtype=int)
+        super().restore_arrays(arrays)
+
+        infected = np.flatnonzero(self.humanState == INFECTED)
+        immune = np.flatnonzero(self.humanState == IMMUNE)
+        if "humanEventStep" in arrays:
+            self.humanEventStep = np.array(arrays["humanEventStep"], dtype=int)
+            self.humanDeathStep = np.array(arrays["humanDeathStep"], dtype=int)
+        else:
+            self.humanEventStep = np.full(n, -1, dtype=int)
+            start = self.humanInfectedAt[infected]
+            self.humanEventStep[infected] = start + sample_remaining_age(
+                self.infectionTable, self.rng, self.step - start
+            )
+            start = self.humanImmuneAt[immune]
+            self.humanEventStep[immune] = start + sample_remaining_age(
+                self.immunityTable, self.rng, self.step - start
+            )
+            self.humanDeathStep = np.zeros(n, dtype=int)
+            self.schedule_natural_deaths(np.arange(n), self.step)
+
+        # infections of the coming step that are not counted yet
+        self.newInfections = int(
+            np.count_nonzero(self.humanInfectedAt[infected] == self.step)
+        )
+
+        self.infectionCalendar = Calendar()
+        self.immunityCalendar = Calendar()
+        self.deathCalendar = Calendar()
+        self.hungerCalendar = Calendar()
+        self.infectionCalendar.schedule(infected, self.humanEventStep[infected])
+        self.immunityCalendar.schedule(immune, self.humanEventStep[immune])
+        alive = np.flatnonzero(self.humanDeathStep >= 0)
+        self.deathCalendar.schedule(alive, self.humanDeathStep[alive])
+        sated = np.flatnonzero(~self.mosquitoHungry)
+        self.hungerCalendar.schedule(sated, self.mosquitoHungryAt[sated])
+
+    def schedule_natural_deaths(self, index, firstStep):
+        """
+        Draws the step of the next natural death of the given humans, whose
+        first natural death check is in firstStep.
+        """
+        if self.humanNaturalDeathProb <= 0:
+            self.humanDeathStep[index] = -1
+            return
+        steps = (
+            firstStep
+            - 1
+            + self.rng.geometric(self.humanNaturalDeathProb, size=index.size)
+        )
+        self.humanDeathStep[index] = steps
+        self.deathCalendar.schedule(index, steps)
+
+    def infect_humans(self, index):
+        # a human bitten by several infected mosquitos appears more than once
+        index = np.unique(index)
+        self.humanState[index] = INFECTED
+        self.humanInfectedAt[index] = self.step
+        self.newInfections += index.size
+
+        steps = self.step + sample_age(self.infectionTable, self.rng, index.size)
+        self.humanEventStep[index] = steps
+        self.infectionCalendar.schedule(index, steps)
+
+    def feed_mosquitoes(self, index):
+        self.mosquitoHungry[index] = False
+        self.mosquitoHungryAt[index] = self.step + self.mealInterval
+        self.hungerCalendar.schedule(index, self.mosquitoHungryAt[index])
+
+    def respawn_mosquitoes(self, dead):
+        super().respawn_mosquitoes(dead)
+        sated = dead[~self.mosquitoHungry[dead]]
+        self.mosquitoHungryAt[dead] = -1
+        self.mosquitoHungryAt[sated] = self.step + self.mealInterval + 1
+        self.hungerCalendar.schedule(sated, self.mosquitoHungryAt[sated])
+
+    def update_hunger(self):
+        """
+        Mosquitos scheduled for this step become hungry again.
+        """
+        due = self.hungerCalendar.pop(self.step)
+        due = due[(self.mosquitoHungryAt[due] == self.step) & ~self.mosquitoHungry[due]]
+        self.mosquitoHungry[due] = True
+        self.mosquitoHungryAt[due] = -1
+
+    def due_humans(self, calendar, state):
+        """
+        Humans of calendar whose scheduled event in this step is still
+        valid.
+        """
+        due = calendar.pop(self.step)
+        return due[
+            (self.humanEventStep[due] == self.step) & (self.humanState[due] == state)
+        ]
+
+    def recover_humans(self):
+        """
+        Infections and immunities scheduled to end in this step end, see
+        VectorizedModel.recover_humans.
+        """
+        # add the infections of this step to the total
+        self.infectedCount += self.newInfections
+        self.newInfections = 0
+
+        # immunities ending in this step (before new immunities are added,
+        # which end in a later step anyway)
+        loses = self.due_humans(self.immunityCalendar, IMMUNE)
+
+        recovered = self.due_humans(self.infectionCalendar, INFECTED)
+        self.infectedCount -= recovered.size
+
+        # human dies or gets immune
+        dies = self.rng.random(recovered.size) <= self.humanDeathByInfectionProb
+        infectionDeaths = recovered[dies]
+        newImmune = recovered[~dies]
+        self.deathCount += infectionDeaths.size
+        self.humanState[infectionDeaths] = SUSCEPTIBLE
+        self.humanEventStep[infectionDeaths] = -1
+
+        self.humanState[newImmune] = IMMUNE
+        self.humanImmuneAt[newImmune] = self.step
+        steps = self.step + sample_age(self.immunityTable, self.rng, newImmune.size)
+        self.humanEventStep[newImmune] = steps
+        self.immunityCalendar.schedule(newImmune, steps)
+        self.immunityCount += newImmune.size
+
+        self.immunityCount -= loses.size
+        self.humanState[loses] = SUSCEPTIBLE
+        self.humanEventStep[loses] = -1
+
+        return infectionDeaths
+
+    def human_deaths(self, infectionDeaths):
+        """
+        Humans scheduled to die of natural causes in this step die. They and
+        the humans in infectionDeaths are replaced by susceptible humans on
+        free cells.
+        """
+        naturalDeaths = self.deathCalendar.pop(self.step)
+        naturalDeaths = naturalDeaths[self.humanDeathStep[naturalDeaths] == self.step]
+        self.deathCount += naturalDeaths.size
+        state = self.humanState[naturalDeaths]
+        self.infectedCount -= int(np.count_nonzero(state == INFECTED))
+        self.immunityCount -= int(np.count_nonzero(state == IMMUNE))
+
+        self.rebirth_humans(np.union1d(infectionDeaths, naturalDeaths))
+
+        # the geometric death time is memoryless, so only the humans that
+        # died of natural causes need a new one
+        self.schedule_natural_deaths(naturalDeaths, self.step + 1)
+
+    def rebirth_humans(self, index):
+        super().rebirth_humans(index)
+        self.humanEventStep[index] = -1
+
+    """
+    The counters of VectorizedModel, derived from the scheduled steps. The
+    setters are used while the base class builds the populations.
+    """
+
+    @property
+    def humanLastInfection(self):
+        return np.where(
+            self.humanState == INFECTED, self.step - self.humanInfectedAt, 0
+        )
+
+    @humanLastInfection.setter
+    def humanLastInfection(self, value):
+        self.humanInfectedAt = self.step - np.asarray(value, dtype=int)
+
+    @property
+    def humanLastImmunity(self):
+        return np.where(
+            self.humanState == IMMUNE, self.step - 1 - self.humanImmuneAt, 0
+        )
+
+    @humanLastImmunity.setter
+    def humanLastImmunity(self, value):
+        self.humanImmuneAt = self.step - 1 - np.asarray(value, dtype=int)
+
+    @property
+    def mosquitoLastMeal(self):
+        return np.where(
+            self.mosquitoHungry,
+            0,
+            self.mealInterval + self.step - self.mosquitoHungryAt,
+        )
+
+    @mosquitoLastMeal.setter
+    def mosquitoLastMeal(self, value):
+        self.mosquitoHungryAt = np.where(
+            self.mosquitoHungry,
+            -1,
+            self.mealInterval + self.step - np.asarray(value, dtype=int),
+        )
@@ -0,0 +1,395 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from malaria_core import Model, keyed_seed
+from malaria_convergence import stable_statistics
+from malaria_cache import result_key
+from LAB5 import run_simulation
+
+"""
+Exploration of the joint space of several Model parameters. The ranges are
+mapped to the unit cube, which is first covered by a space-filling design
+(a Latin hypercube, or a scrambled Sobol sequence when scipy is installed)
+and then refined adaptively: new runs are placed halfway between
+neighbouring points whose stable infection fractions differ by more than a
+tolerance, until neighbours are closer than the requested resolution. The
+runs end up concentrated where the infection fraction changes quickly, e.g.
+around the epidemic threshold, while flat regions keep the spacing of the
+initial design.
+"""
+
+
+def latin_hypercube(n, d, rng):
+    """
+    n points of a Latin hypercube in the unit cube [0, 1)^d: every axis is
+    cut into n equal strata and each stratum holds exactly one point, at a
+    uniformly random position inside it.
+    """
+    strata = np.argsort(rng.random((d, n)), axis=1).T
+    return (strata + rng.random((n, d))) / n
+
+
+def sobol(n, d, rng):
+    """
+    First n points of a scrambled Sobol sequence in the unit cube [0, 1)^d.
+    n should be a power of 2 for the balance properties of the sequence.
+    """
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ImportError("the sobol design requires scipy")
+
+    return qmc.Sobol(d, scramble=True, seed=rng).random(n)
+
+
+DESIGNS = {"lhs": latin_hypercube, "sobol": sobol}
+
+
+class ParameterSpace:
+    def __init__(self, ranges, log=()):
+        """
+        Box of parameter values, ranges maps a Model parameter to its
+        (minimum, maximum). The parameters in log are scaled
+        logarithmically, e.g. probabilities spanning several decades.
+        Parameters whose minimum and maximum are both ints (like nMosquito)
+        are rounded to ints.
+        """
+        self.names = list(ranges)
+        self.low = np.array([ranges[name][0] for name in self.names], dtype=float)
+        self.high = np.array([ranges[name][1] for name in self.names], dtype=float)
+        self.log = np.array([name in log for name in self.names])
+        self.integer = np.array(
+            [
+                all(isinstance(bound, int) for bound in ranges[name])
+                for name in self.names
+            ]
+        )
+
+        if np.any(self.low[self.log] <= 0):
+            raise ValueError("log scaled parameters need a positive minimum")
+
+    @property
+    def dimension(self):
+        return len(self.names)
+
+    def scale(self, unit):
+        """
+        Parameter values (array of shape (n, dimension)) of the points unit
+        in the unit cube.
+        """
+        unit = np.asarray(unit, dtype=float)
+        linear = self.low + unit * (self.high - self.low)
+        logarithmic = self.low * (self.high / self.low) ** unit
+        values = np.where(self.log, logarithmic, linear)
+        return np.where(self.integer, np.round(values), values)
+
+    def values(self, unit):
+        """
+        List of dictionaries of parameter values, one for every point of
+        unit, with ints for the integer parameters.
+        """
+        return [
+            {
+                name: int(value) if integer else float(value)
+                for name, value, integer in zip(self.names, point, self.integer)
+            }
+            for point in self.scale(unit)
+        ]
+
+
+class Exploration:
+    def __init__(
+        self,
+        steps,
+        base_values,
+        space,
+        model=Model,
+        seed=None,
+        precision=None,
+        processes=1,
+        cache=None,
+    ):
+        """
+        Runs of model for points of space (a ParameterSpace), with the
+        other parameters at base_values. Every point gets a random stream
+        derived from seed and its parameter values, so a point gives the
+        same result whatever design or refinement placed it. precision,
+        processes and cache work as in LAB5.parameter_sweep. The explored
+        points are kept in unit (coordinates in the unit cube), infection
+        (stable mean infection fraction) and infectionStd.
+        """
+        self.steps = steps
+        self.baseValues = dict(base_values)
+        self.space = space
+        self.model = model
+        self.precision = precision
+        self.processes = processes
+
+        if seed is None:
+            cache = None
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed = seed
+        self.cache = cache
+        self.rng = np.random.default_rng(keyed_seed(seed, "design"))
+
+        self.unit = np.empty((0, space.dimension))
+        self.infection = np.empty(0)
+        self.infectionStd = np.empty(0)
+
+    def __len__(self):
+        return self.infection.size
+
+    @property
+    def parameters(self):
+        """
+        Parameter values of the explored points, shape (n, dimension).
+        """
+        return self.space.scale(self.unit)
+
+    def evaluate(self, unit):
+        """
+        Runs the model for the points unit (in the unit cube) and adds them
+        to the exploration.
+        """
+        unit = np.atleast_2d(np.asarray(unit, dtype=float))
+        arguments = []
+        keys = []
+        for point in self.space.values(unit):
+            parameter_values = dict(self.baseValues, **point)
+            point_seed = keyed_seed(self.seed, *sorted(point.items()))
+            label = f"{len(self) + len(arguments)}: {point}, "
+            arguments.append(
+                (
+                    self.model,
+                    parameter_values,
+                    self.steps,
+                    point_seed,
+                    label,
+                    self.precision,
+                )
+            )
+            keys.append(
+                result_key(
+                    self.model,
+                    parameter_values,
+                    self.steps,
+                    point_seed,
+                    precision=self.precision,
+                )
+            )
+
+        series = [
+            self.cache.get(key) if self.cache is not None else None for key in keys
+        ]
+        missing = [i for i, result in enumerate(series) if result is None]
+
+        def store(i, result):
+            series[i] = result
+            if self.cache is not None:
+                self.cache.put(keys[i], result, arguments[i][1])
+
+        if self.processes == 1:
+            for i in missing:
+                store(i, run_simulation(*arguments[i]))
+        elif missing:
+            with ProcessPoolExecutor(max_workers=self.processes) as pool:
+                computed = pool.map(
+                    run_simulation, *zip(*[arguments[i] for i in missing])
+                )
+                for i, result in zip(missing, computed):
+                    store(i, result)
+
+        # stable mean and standard deviation after the MSER transient
+        statistics = np.array([stable_statistics(s)[:2] for s in series]).reshape(-1, 2)
+        self.unit = np.concatenate([self.unit, unit])
+        self.infection = np.concatenate([self.infection, statistics[:, 0]])
+        self.infectionStd = np.concatenate([self.infectionStd, statistics[:, 1]])
+
+    def sample(self, n, design="lhs"):
+        """
+        Adds n points of a space-filling design, "lhs" or "sobol" (see
+        DESIGNS).
+        """
+        self.evaluate(DESIGNS[design](n, self.space.dimension, self.rng))
+
+    def neighbours(self, k=None):
+        """
+        Pairs (i, j), i < j, of every explored point and its k nearest
+        neighbours in the unit cube (2 * dimension by default), as two index
+        arrays. The distances are computed for all pairs at once, which
+        limits an exploration to some thousands of points.
+        """
+        n = len(self)
+        k = min(k or 2 * self.space.dimension, n - 1)
+        if k < 1:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+        squares = np.sum(self.unit**2, axis=1)
+        distance = squares[:, None] + squares[None, :] - 2 * self.unit @ self.unit.T
+        np.fill_diagonal(distance, np.inf)
+        nearest = np.argpartition(distance, k - 1, axis=1)[:, :k]
+
+        i = np.repeat(np.arange(n), k)
+        j = nearest.ravel()
+        pairs = np.unique(np.minimum(i, j) * n + np.maximum(i, j))
+        return pairs // n, pairs % n
+
+    def candidates(self, tolerance, resolution):
+        """
+        Midpoints of the neighbouring pairs whose infection fractions differ
+        by more than tolerance while they are further than resolution apart
+        along some axis, the largest differences first. Midpoints closer
+        than resolution / 2 (along every axis) to an explored point or an
+        earlier candidate are left out.
+        """
+        i, j = self.neighbours()
+        change = np.abs(self.infection[i] - self.infection[j])
+        span = np.abs(self.unit[i] - self.unit[j]).max(axis=1)
+        split = (change > tolerance) & (span > resolution)
+        order = np.argsort(-change[split], kind="stable")
+        midpoints = (self.unit[i[split]] + self.unit[j[split]])[order] / 2
+
+        accepted = []
+        points = self.unit
+        for midpoint in midpoints:
+            if np.all(np.abs(points - midpoint).max(axis=1) >= resolution / 2):
+                accepted.append(midpoint)
+                points = np.vstack([points, midpoint])
+        return np.array(accepted).reshape(-1, self.space.dimension)
+
+    def refine(self, tolerance=0.01, resolution=1 / 32, batch=None):
+        """
+        One refinement round: runs the model at up to batch (all by
+        default) candidates, see candidates(). Returns the number of new
+        points, 0 once the map is resolved.
+        """
+        new = self.candidates(tolerance, resolution)[:batch]
+        if len(new):
+            self.evaluate(new)
+        return len(new)
+
+    def nearest(self, unit):
+        """
+        Infection fraction of the explored point nearest to each point of
+        unit, e.g. to draw the map on a regular grid.
+        """
+        unit = np.atleast_2d(np.asarray(unit, dtype=float))
+        distance = np.sum((unit[:, None, :] - self.unit[None, :, :]) ** 2, axis=-1)
+        return self.infection[np.argmin(distance, axis=1)]
+
+
+def dense_grid_runs(dimension, resolution):
+    """
+    Number of runs of a regular grid with spacing resolution in the unit
+    cube of dimension dimensions.
+    """
+    return (int(np.ceil(1 / resolution)) + 1) ** dimension
+
+
+def explore(
+    steps,
+    init_parameters,
+    ranges,
+    log=(),
+    model=Model,
+    initial=64,
+    design="lhs",
+    tolerance=0.01,
+    resolution=1 / 32,
+    batch=None,
+    maxRuns=2000,
+    seed=None,
+    precision=None,
+    processes=1,
+    cache=None,
+):
+    """
+    Map the stable infection fraction over the box ranges (see
+    ParameterSpace), with the other parameters at the values of
+    init_parameters (a dictionary like LAB5.parameters). Starts with
+    initial points of design and refines until every pair of neighbouring
+    points either differs by at most tolerance or is within resolution
+    (a fraction of each range) along every axis, or maxRuns runs are done.
+    tolerance should be larger than the run to run scatter of the stable
+    infection fraction, or the noise itself gets refined. Returns the
+    Exploration.
+    """
+    base_values = {key: value[0] for key, value in init_parameters.items()}
+    exploration = Exploration(
+        steps,
+        base_values,
+        ParameterSpace(ranges, log),
+        model=model,
+        seed=seed,
+        precision=precision,
+        processes=processes,
+        cache=cache,
+    )
+    exploration.sample(min(initial, maxRuns), design)
+
+    while len(exploration) < maxRuns:
+        budget = maxRuns - len(exploration)
+        added = exploration.refine(tolerance, resolution, min(batch or budget, budget))
+        print(f"{added} new points, {len(exploration)} runs")
+        if not added:
+            break
+
+    return exploration
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
+    import LAB5
+    from malaria_cache import ResultCache
+
+    steps = 1000
+
+    # effect of mosquito numbers, pesticide treatment and bed nets
+    ranges = {
+        "nMosquito": (500, 8000),
+        "mosquitoNaturalDeathProb": (0.001, 0.2),
+        "biteProb": (0.05, 1.0),
+    }
+    log = ("mosquitoNaturalDeathProb",)
+    resolution = 1 / 32
+
+    exploration = explore(
+        steps,
+        LAB5.parameters,
+        ranges,
+        log=log,
+        resolution=resolution,
+        seed=0,
+        precision=0.01,
+        processes=None,
+        cache=ResultCache("sweep_cache"),
+    )
+    print(
+        f"{len(exploration)} runs, a dense grid at the same resolution needs "
+        f"{dense_grid_runs(exploration.space.dimension, resolution)}"
+    )
+
+    # projections of the explored points on every pair of parameters
+    names = exploration.space.names
+    pairs = [(a, b) for a in range(len(names)) for b in range(a + 1, len(names))]
+    fig, axes = plt.subplots(1, len(pairs), figsize=(5 * len(pairs), 4))
+    for ax, (a, b) in zip(np.atleast_1d(axes), pairs):
+        points = ax.scatter(
+            exploration.parameters[:, a],
+            exploration.parameters[:, b],
+            c=exploration.infection,
+            s=8,
+            vmin=0,
+        )
+        ax.set_xlabel(names[a])
+        ax.set_ylabel(names[b])
+        if a in np.flatnonzero(exploration.space.log):
+            ax.set_xscale("log")
+        if b in np.flatnonzero(exploration.space.log):
+            ax.set_yscale("log")
+    fig.colorbar(points, ax=axes, label="infection fraction")
+    plt.savefig("exploration.png")
+    plt.show()
@@ -0,0 +1,26 @@
+import numpy as np
+
+"""
+JSON forms of the values that the result cache, the recorder and the
+checkpoints store in their metadata.
+"""
+
+
+def seed_description(seed):
+    """
+    JSON serializable description of an int or numpy.random.SeedSequence
+    seed, the same for seeds that give the same random stream.
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return {"entropy": seed.entropy, "spawn_key": list(seed.spawn_key)}
+    return seed
+
+
+def json_value(value):
+    """
+    JSON serializable form of value for json.dumps(default=...): NumPy
+    scalars as the equal Python scalars, anything else through its repr.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    return repr(value)
@@ -0,0 +1,166 @@
+import functools
+import importlib.util
+
+import numpy as np
+
+"""
+Compiled step kernels for the "numba" backend of
+malaria_vectorized.VectorizedModel. Every kernel is a plain loop over the
+struct-of-arrays state and takes its random numbers as pre-drawn arrays from
+the model's generator, so it never touches the random state itself. Numba
+is only imported when a kernel is first compiled, so importing this module
+(and the numpy backend) does not pay for it.
+"""
+HAVE_NUMBA = importlib.util.find_spec("numba") is not None
+
+# integer codes of malaria_vectorized
+SUSCEPTIBLE = 0
+INFECTED = 1
+IMMUNE = 2
+
+
+@functools.lru_cache(maxsize=None)
+def compiled(name):
+    """
+    The kernel called name compiled with numba.njit, imports Numba on the
+    first call.
+    """
+    import numba
+
+    return numba.njit(cache=True, nogil=True)(globals()[name])
+
+
+def move_kernel(x, y, deltaX, deltaY, width, height):
+    """
+    Moves every mosquito by (deltaX, deltaY) with periodic boundaries, in
+    place.
+    """
+    for i in range(x.size):
+        x[i] = (x[i] + deltaX[i]) % width
+        y[i] = (y[i] + deltaY[i]) % height
+
+
+def bite_kernel(
+    x,
+    y,
+    hungry,
+    infected,
+    lastMeal,
+    humanGrid,
+    humanState,
+    humanLastInfection,
+    biteRoll,
+    infectionRoll,
+    biteProb,
+    humanInfectionProb,
+    mosquitoInfectionProb,
+):
+    """
+    Hungry mosquitos on a cell with a human bite with probability biteProb,
+    see VectorizedModel.bite_humans. The new human infections are applied
+    after the loop, so every bite sees the human states at the start of the
+    phase, just like the NumPy backend. Returns the number of bites, human
+    infections and mosquito infections.
+    """
+    newHumans = np.empty(x.size, dtype=np.int64)
+    bites = 0
+    humanInfections = 0
+    mosquitoInfections = 0
+
+    for i in range(x.size):
+        if not hungry[i]:
+            continue
+        human = humanGrid[x[i], y[i]]
+        if human < 0 or biteRoll[i] > biteProb:
+            continue
+        bites += 1
+
+        state = humanState[human]
+        if infected[i]:
+            if state == SUSCEPTIBLE and infectionRoll[i] <= humanInfectionProb:
+                newHumans[humanInfections] = human
+                humanInfections += 1
+        elif state == INFECTED and infectionRoll[i] <= mosquitoInfectionProb:
+            infected[i] = True
+            mosquitoInfections += 1
+
+        hungry[i] = False
+        lastMeal[i] = 0
+
+    for k in range(humanInfections):
+        humanState[newHumans[k]] = INFECTED
+        humanLastInfection[newHumans[k]] = 0
+
+    return bites, humanInfections, mosquitoInfections
+
+
+def hunger_kernel(hungry, lastMeal, mealInterval):
+    """
+    Mosquitos that are not hungry become hungry again after mealInterval
+    timesteps.
+    """
+    for i in range(hungry.size):
+        if hungry[i]:
+            continue
+        lastMeal[i] += 1
+        if lastMeal[i] > mealInterval:
+            hungry[i] = True
+            lastMeal[i] = 0
+
+
+def recover_kernel(
+    humanState,
+    humanLastInfection,
+    humanLastImmunity,
+    endRoll,
+    deathRoll,
+    lossRoll,
+    infectionPeriod,
+    immunityPeriod,
+    humanDeathByInfectionProb,
+    counterMax,
+):
+    """
+    Infected humans recover (and die or become immune) and immune humans
+    lose their immunity, see VectorizedModel.recover_humans. The ages
+    saturate at counterMax. Returns the indices of the humans that died of
+    the infection and the changes of the infected count, death count and
+    immunity count.
+    """
+    infectionDeaths = np.empty(humanState.size, dtype=np.int64)
+    deaths = 0
+    infectedChange = 0
+    immunityChange = 0
+    infectionWidth = np.sqrt(infectionPeriod)
+    immunityWidth = np.sqrt(immunityPeriod)
+
+    for i in range(humanState.size):
+        state = humanState[i]
+        if state == INFECTED:
+            age = int(humanLastInfection[i])
+            # add infection to the total when human just got infected
+            if age == 0:
+                infectedChange += 1
+
+            if endRoll[i] > np.exp(-((age - infectionPeriod) ** 2) / infectionWidth):
+                humanLastInfection[i] = min(age + 1, counterMax)
+                continue
+            infectedChange -= 1
+
+            if deathRoll[i] <= humanDeathByInfectionProb:
+                humanState[i] = SUSCEPTIBLE
+                infectionDeaths[deaths] = i
+                deaths += 1
+            else:
+                humanState[i] = IMMUNE
+                humanLastImmunity[i] = 0
+                immunityChange += 1
+
+        elif state == IMMUNE:
+            age = min(int(humanLastImmunity[i]) + 1, counterMax)
+            humanLastImmunity[i] = age
+            if lossRoll[i] <= np.exp(-((age - immunityPeriod) ** 2) / immunityWidth):
+                humanState[i] = SUSCEPTIBLE
+                immunityChange -= 1
+
+    return infectionDeaths[:deaths], infectedChange, deaths, immunityChange
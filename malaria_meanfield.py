@@ -0,0 +1,431 @@
+import glob
+import os
+
+import numpy as np
+
+from malaria_convergence import stable_statistics
+from malaria_core import COLUMNS, DEFAULTS
+from malaria_vectorized import transition_probability
+
+"""
+Deterministic mean-field surrogate of the agent model: difference equations
+for the expected fractions of humans and mosquitos in every state, with the
+same phases and parameters as VectorizedModel.advance. Space is ignored, a
+hungry mosquito meets a human with probability nHuman / (width * height)
+and bites a uniformly random one. The infection and immunity ages keep the
+bell shaped hazards of the agents, the mosquitos are split by the time
+since their last meal.
+
+The equilibrium is solved in closed form per parameter point, so a grid of
+millions of points takes seconds. It matches agents that are placed at
+random every step, but misses what the agents get from space and chance:
+the clustering of the infections around the mosquitos' walks (calibrate
+fits a contact factor for it) and the extinction of the infection in small
+populations. It is meant to screen a parameter space before running the
+agent model where it matters.
+"""
+
+
+def index_fraction(fraction, n):
+    """
+    Fraction of the agents with index i < n for which i / n <= fraction,
+    the rule the models use for the initially infected humans and the
+    (re)spawned hungry mosquitos.
+    """
+    n = np.maximum(n, 1)
+    return np.clip(np.floor(fraction * n) + 1, 0, n) / n
+
+
+def hazard_table(period, firstAge=0):
+    """
+    Per-age probabilities transition_probability(age, period) of the given
+    periods (an array), on the common age axis 0 .. max(ceil(period)) as
+    the last axis. The transition is forced at age ceil(period), where it
+    is certain for an integer period, so no age beyond it is reached.
+    Ages below firstAge are never checked.
+    """
+    last = np.ceil(period).astype(int)
+    ages = np.arange(last.max(initial=0) + 1)
+    hazard = transition_probability(ages, np.asarray(period, dtype=float)[..., None])
+    hazard = np.where(ages >= last[..., None], 1.0, hazard)
+    return np.where(ages >= firstAge, hazard, 0.0)
+
+
+class MeanField:
+    def __init__(self, **parameters):
+        """
+        Mean-field model for the parameters of malaria_skeleton.Model. Every
+        parameter can be a single value or an array; the arrays are
+        broadcast against each other, so a grid of parameter points (e.g.
+        from numpy.meshgrid) is solved at once and every result has the
+        broadcast shape.
+        """
+        unknown = set(parameters) - set(DEFAULTS)
+        if unknown:
+            raise TypeError(f"unknown parameters {sorted(unknown)}")
+        values = dict(DEFAULTS, **parameters)
+        values["immunityPeriod"] = values.pop("immuntiyPeriod")
+        arrays = np.broadcast_arrays(
+            *[np.asarray(v, dtype=float) for v in values.values()]
+        )
+        for name, array in zip(values, arrays):
+            setattr(self, name, array)
+        self.shape = arrays[0].shape
+        self.mealInterval = self.mealInterval.astype(int)
+
+        cells = self.width * self.height
+        # chance that a hungry mosquito is on the cell of a human and bites
+        self.meetProb = self.biteProb * np.minimum(self.nHuman / cells, 1)
+        # successful infectious bites per human per infected hungry mosquito
+        self.infectionRate = (
+            self.nMosquito * self.biteProb * self.humanInfectionProb / cells
+        )
+        self.respawnHungry = index_fraction(self.initMosquitoHungry, self.nMosquito)
+
+    def equilibrium(self, contact=1.0):
+        """
+        Endemic equilibrium of the difference equations, or the
+        infection-free one when the infection cannot persist. contact
+        scales the chance that a hungry mosquito meets a human (see
+        calibrate). Returns a dictionary of arrays: the infection, mosquito
+        infection and immunity fractions as returned by Model.update, and
+        the expected deaths and mosquito deaths per step.
+
+        Given the infected fraction x of the humans the equilibrium of the
+        mosquitos, and with it the daily chance of infection of a
+        susceptible human, is explicit. The infected fraction that follows
+        from that chance (by renewal over the infection and immunity ages)
+        is increasing in x, so its fixed point is found by bisection. With
+        a long immunity period the difference equations can cycle around
+        this equilibrium instead of settling, see trajectory.
+        """
+        human = self.human_renewal()
+
+        def infected(x):
+            mosquito = self.mosquito_equilibrium(x, contact)
+            risk = self.infection_risk(mosquito["hungryInfected"], contact)
+            return self.human_fractions(risk, human)["infected"]
+
+        # the endemic state exists when the infection grows from a trace
+        low = np.full(self.shape, 1e-9)
+        high = np.ones(self.shape)
+        endemic = infected(low) > low
+        for _ in range(60):
+            middle = (low + high) / 2
+            grows = infected(middle) > middle
+            low = np.where(grows, middle, low)
+            high = np.where(grows, high, middle)
+        x = np.where(endemic, (low + high) / 2, 0.0)
+
+        m = self.mosquito_equilibrium(x, contact)
+        risk = self.infection_risk(m["hungryInfected"], contact)
+        fractions = self.human_fractions(risk, human)
+        return {
+            "infection_fraction": fractions["infected"],
+            "mosquito_infection_fraction": m["infected"],
+            "immunity_fraction": fractions["immune"],
+            "death_rate": self.nHuman * fractions["deaths"],
+            "mosquito_death_rate": self.nMosquito * self.mosquitoNaturalDeathProb,
+        }
+
+    def infection_risk(self, hungryInfected, contact=1.0):
+        """
+        Chance that a susceptible human is infected in the bite phase, when
+        hungryInfected is the fraction of the mosquitos that is hungry and
+        infected. The number of successful bites is Poisson.
+        """
+        return 1 - np.exp(-contact * self.infectionRate * hungryInfected)
+
+    def mosquito_equilibrium(self, x, contact=1.0):
+        """
+        Fractions of the mosquitos that are hungry, hungry and infected,
+        and infected at the end of a step, in equilibrium with an infected
+        fraction x of the humans. A fed mosquito is sated for mealInterval
+        hunger updates, every mosquito survives a step with probability
+        survival and the dead respawn non-infected.
+        """
+        survival = 1 - self.mosquitoNaturalDeathProb
+        bite = contact * self.meetProb
+        cycle = survival ** (self.mealInterval + 1)
+        respawnSated = self.mosquitoNaturalDeathProb * (1 - self.respawnHungry)
+
+        denominator = 1 - survival * (1 - bite) - cycle * bite
+        hungry = (
+            cycle * respawnSated + self.mosquitoNaturalDeathProb * self.respawnHungry
+        ) / denominator
+        catch = self.mosquitoInfectionProb * x
+        hungryInfected = (
+            cycle * bite * catch * hungry / (denominator + cycle * bite * catch)
+        )
+
+        # infected bites per step, which survive the sated classes
+        infectedBites = bite * (hungryInfected + catch * (hungry - hungryInfected))
+        sated = np.where(
+            survival < 1,
+            survival
+            * (1 - survival**self.mealInterval)
+            / np.maximum(1 - survival, 1e-300),
+            self.mealInterval,
+        )
+        return {
+            "hungry": hungry,
+            "hungryInfected": hungryInfected,
+            "infected": hungryInfected + infectedBites * sated,
+        }
+
+    def human_renewal(self):
+        """
+        Expected steps a human spends infected and immune per infection, and
+        the chance that an infection ends by the infection hazard (rather
+        than a natural death), from the age tables. These do not depend on
+        the force of infection. The tables are only built once for every
+        distinct combination of the periods and the natural death
+        probability, so large grids do not need a table per point.
+        """
+        keys = np.stack(
+            [self.infectionPeriod, self.immunityPeriod, self.humanNaturalDeathProb],
+            axis=-1,
+        ).reshape(-1, 3)
+        keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+        infectionPeriod, immunityPeriod, deathProb = keys.T
+        survival = 1 - deathProb[:, None]
+
+        hazard = hazard_table(infectionPeriod)
+        # alive and infected at the start of the recovery phase of age a
+        start = np.cumprod(
+            np.concatenate(
+                [np.ones((keys.shape[0], 1)), ((1 - hazard) * survival)[:, :-1]],
+                axis=-1,
+            ),
+            axis=-1,
+        )
+        infectedSteps = (start * (1 - hazard) * survival).sum(axis=-1)
+        ends = (start * hazard).sum(axis=-1)
+
+        # immune at the end of the steps after the one of the recovery
+        hazard = hazard_table(immunityPeriod, firstAge=1)
+        immuneSteps = 1 + np.cumprod((1 - hazard[:, 1:]) * survival, axis=-1).sum(
+            axis=-1
+        )
+
+        def expand(values):
+            return values[inverse.reshape(-1)].reshape(self.shape)
+
+        ends = expand(ends)
+        immuneSteps = (
+            ends
+            * (1 - self.humanDeathByInfectionProb)
+            * (1 - self.humanNaturalDeathProb)
+            * expand(immuneSteps)
+        )
+        return {"infected": expand(infectedSteps), "immune": immuneSteps, "ends": ends}
+
+    def human_fractions(self, risk, renewal):
+        """
+        Equilibrium fractions of infected and immune humans and the deaths
+        per human per step when a susceptible human is infected with
+        probability risk per step. A human cycles through susceptible (for
+        1 / risk steps on average), infected and immune; a natural death
+        restarts the cycle.
+        """
+        cycle = 1 + risk * (renewal["infected"] + renewal["immune"])
+        infectionDeaths = risk * renewal["ends"] * self.humanDeathByInfectionProb
+        return {
+            "infected": risk * renewal["infected"] / cycle,
+            "immune": risk * renewal["immune"] / cycle,
+            "deaths": infectionDeaths / cycle + self.humanNaturalDeathProb,
+        }
+
+    def trajectory(self, steps, contact=1.0):
+        """
+        Iterates the difference equations from the initial populations of
+        the parameters and returns the expected statistics of every step as
+        an array of shape (steps, *shape, 5), in the order of COLUMNS like
+        Model.update. The cost grows with the infection and immunity
+        periods, equilibrium is much faster when only the end state is
+        needed.
+        """
+        survival = 1 - self.humanNaturalDeathProb
+        infectionHazard = hazard_table(self.infectionPeriod)
+        immunityHazard = hazard_table(self.immunityPeriod, firstAge=1)
+
+        infected = np.zeros(infectionHazard.shape)
+        infected[..., 0] = index_fraction(self.initHumanInfected, self.nHuman)
+        susceptible = 1 - infected[..., 0]
+        immune = np.zeros(immunityHazard.shape)
+
+        # mosquitos by infection (axis -2) and class (last axis): hungry and
+        # sated with their last meal 0 .. mealInterval + 1 steps ago
+        classes = np.arange(self.mealInterval.max(initial=0) + 3)
+        overdue = classes == self.mealInterval[..., None] + 2
+        mosquitos = np.zeros(self.shape + (2, classes.size))
+        hungry = index_fraction(self.initMosquitoHungry, self.nMosquito)
+        for state, fraction in enumerate(
+            (1 - self.initMosquitoInfected, self.initMosquitoInfected)
+        ):
+            mosquitos[..., state, 0] = hungry * fraction
+            mosquitos[..., state, 1] = (1 - hungry) * fraction
+
+        deaths = np.zeros(self.shape)
+        mosquitoDeaths = np.zeros(self.shape)
+        result = np.empty((steps,) + self.shape + (len(COLUMNS),))
+        for t in range(steps):
+            mosquitoInfected = mosquitos[..., 1, :].sum(axis=-1)
+
+            # bites, against the human states at the start of the phase
+            x = infected.sum(axis=-1)
+            risk = self.infection_risk(mosquitos[..., 1, 0], contact)
+            infected[..., 0] += susceptible * risk
+
+            bite = contact * self.meetProb
+            bitten = mosquitos[..., 0] * bite[..., None]
+            caught = bitten[..., 0] * self.mosquitoInfectionProb * x
+            mosquitos[..., 0] -= bitten
+            mosquitos[..., 1, 1] += bitten[..., 1] + caught
+            mosquitos[..., 0, 1] += bitten[..., 0] - caught
+
+            # hunger: the sated get one step older, the overdue get hungry
+            mosquitos[..., 2:] = mosquitos[..., 1:-1].copy()
+            mosquitos[..., 1] = 0
+            mosquitos[..., 0] += (mosquitos * overdue[..., None, :]).sum(axis=-1)
+            mosquitos *= ~overdue[..., None, :]
+
+            # mosquito deaths, respawned non-infected
+            mosquitos *= (1 - self.mosquitoNaturalDeathProb)[..., None, None]
+            mosquitos[..., 0, 0] += self.mosquitoNaturalDeathProb * self.respawnHungry
+            mosquitos[..., 0, 1] += self.mosquitoNaturalDeathProb * (
+                1 - self.respawnHungry
+            )
+            mosquitoDeaths += self.nMosquito * self.mosquitoNaturalDeathProb
+
+            # recovery and loss of immunity
+            ends = infected * infectionHazard
+            infected = np.concatenate(
+                [np.zeros(self.shape + (1,)), (infected - ends)[..., :-1]], axis=-1
+            )
+            ended = ends.sum(axis=-1)
+            dies = ended * self.humanDeathByInfectionProb
+            immune = np.concatenate(
+                [(ended - dies)[..., None], immune[..., :-1]], axis=-1
+            )
+            loses = immune[..., 1:] * immunityHazard[..., 1:]
+            immune[..., 1:] -= loses
+            deaths += self.nHuman * dies
+
+            # natural deaths; the dead and the recovered are susceptible
+            infected *= survival[..., None]
+            immune *= survival[..., None]
+            susceptible = 1 - infected.sum(axis=-1) - immune.sum(axis=-1)
+            deaths += self.nHuman * self.humanNaturalDeathProb
+
+            result[t] = np.stack(
+                [
+                    infected.sum(axis=-1),
+                    mosquitoInfected,
+                    deaths,
+                    mosquitoDeaths,
+                    immune.sum(axis=-1),
+                ],
+                axis=-1,
+            )
+        return result
+
+
+"""
+Comparison with the agent-based sweeps stored as data_<parameter>_<value>.csv
+by LAB5, in DATA_DIRECTORY next to this module.
+"""
+DATA_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_data(pattern="data_*.csv", directory=DATA_DIRECTORY):
+    """
+    List of (parameter, value, infection fractions) of the sweep files
+    matching pattern in directory, sorted by parameter and value.
+    """
+    runs = []
+    for path in glob.glob(os.path.join(directory, pattern)):
+        name = os.path.splitext(os.path.basename(path))[0]
+        _, parameter, value = name.rsplit("_", 2)
+        series = np.loadtxt(path, delimiter=",", skiprows=1, usecols=-1, ndmin=1)
+        runs.append((parameter, float(value), series))
+    return sorted(runs, key=lambda run: run[:2])
+
+
+def compare(runs, base_values, contact=1.0):
+    """
+    Table (list of dictionaries) of the stable mean infection fraction of
+    every agent run in runs (see read_data, the MSER transient is dropped)
+    next to the mean-field equilibrium for base_values with the parameter
+    of the run changed.
+    """
+    table = []
+    for parameter, value, series in runs:
+        mean, std, cutoff = stable_statistics(series)
+        model = MeanField(**dict(base_values, **{parameter: value}))
+        equilibrium = model.equilibrium(contact)["infection_fraction"]
+        table.append(
+            {
+                "parameter": parameter,
+                "value": value,
+                "agents": float(mean),
+                "agents_std": float(std),
+                "meanfield": float(equilibrium),
+            }
+        )
+    return table
+
+
+def calibrate(runs, base_values, contacts=np.logspace(-2, 2, 401)):
+    """
+    The contact factor of contacts for which the mean-field equilibria
+    best match (least squares) the stable infection fractions of the agent
+    runs, and the squared error of every candidate. The factor absorbs what
+    the well-mixed encounter rate misses, like the clustering of the
+    mosquitos around the humans they keep meeting.
+    """
+    if not runs:
+        raise ValueError("no agent runs to calibrate against")
+
+    contacts = np.asarray(contacts, dtype=float)
+    errors = np.zeros(contacts.size)
+    for parameter, value, series in runs:
+        mean = stable_statistics(series)[0]
+        model = MeanField(
+            **dict(base_values, **{parameter: np.full(contacts.size, value)})
+        )
+        errors += (model.equilibrium(contacts)["infection_fraction"] - mean) ** 2
+    return contacts[np.argmin(errors)], errors
+
+
+if __name__ == "__main__":
+    import time
+
+    import LAB5
+
+    base_values = {key: value[0] for key, value in LAB5.parameters.items()}
+    runs = read_data()
+
+    contact, _ = calibrate(runs, base_values)
+    print(f"calibrated contact factor {contact:.3f}")
+    print(
+        f"{'parameter':<26}{'value':>8}{'agents':>9}{'meanfield':>11}{'calibrated':>12}"
+    )
+    for row, calibrated in zip(
+        compare(runs, base_values), compare(runs, base_values, contact)
+    ):
+        print(
+            f"{row['parameter']:<26}{row['value']:>8g}{row['agents']:>9.3f}"
+            f"{row['meanfield']:>11.3f}{calibrated['meanfield']:>12.3f}"
+        )
+
+    # screening speed on a grid of parameter points
+    nHuman, deathProb = np.meshgrid(
+        np.linspace(50, 2000, 500), np.linspace(0.001, 0.2, 500)
+    )
+    start = time.perf_counter()
+    MeanField(
+        **dict(base_values, nHuman=nHuman, mosquitoNaturalDeathProb=deathProb)
+    ).equilibrium()
+    seconds = time.perf_counter() - start
+    print(f"{nHuman.size} equilibria in {seconds:.2f} s")
@@ -0,0 +1,108 @@
+from time import perf_counter
+
+import numpy as np
+
+"""
+Phases of a timestep and events counted by StepProfiler, in order.
+"""
+PHASES = (
+    "move",
+    "bite",
+    "hunger",
+    "mosquito_death",
+    "human_recovery",
+    "human_death",
+)
+EVENTS = (
+    "bites",
+    "human_infections",
+    "mosquito_infections",
+    "mosquito_respawns",
+    "human_rebirths",
+)
+
+
+class StepProfiler:
+    def __init__(self):
+        """
+        Records the wall time spent in every phase of a model's update() and
+        the number of events (bites, infections, respawns) of every step.
+        A model calls start() at the beginning of a step, lap(phase) at the
+        end of every phase, count(event, n) for its events and stop() at the
+        end of the step.
+        """
+        self.steps = []
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.current = None
+        self.lastTime = 0.0
+
+    def start(self):
+        self.current = dict.fromkeys(PHASES + EVENTS, 0)
+        self.lastTime = perf_counter()
+
+    def lap(self, phase):
+        """
+        Assigns the time since the previous lap (or start) to phase.
+        """
+        now = perf_counter()
+        elapsed = now - self.lastTime
+        self.current[phase] += elapsed
+        self.totals[phase] += elapsed
+        self.calls[phase] += 1
+        self.lastTime = now
+
+    def count(self, event, n):
+        self.current[event] += int(n)
+
+    def stop(self):
+        self.steps.append(self.current)
+        self.current = None
+
+    def records(self):
+        """
+        The recorded steps as a structured array with one row per step, a
+        float field (seconds) for every phase and an int field for every
+        event.
+        """
+        dtype = [(phase, float) for phase in PHASES] + [
+            (event, int) for event in EVENTS
+        ]
+        return np.array(
+            [tuple(step[name] for name, _ in dtype) for step in self.steps],
+            dtype=dtype,
+        )
+
+    def summary(self):
+        """
+        Dictionary with the total time, number of calls and mean time per
+        call of every phase and the total count of every event.
+        """
+        summary = dict()
+        for phase in PHASES:
+            calls = self.calls[phase]
+            summary[phase] = {
+                "total": self.totals[phase],
+                "calls": calls,
+                "mean": self.totals[phase] / calls if calls else 0.0,
+            }
+        for event in EVENTS:
+            summary[event] = sum(step[event] for step in self.steps)
+        return summary
+
+    def report(self):
+        """
+        Human readable table of summary().
+        """
+        summary = self.summary()
+        total = sum(self.totals.values()) or 1.0
+        lines = [f"{'phase':<20}{'total [s]':>12}{'calls':>8}{'share':>8}"]
+        for phase in PHASES:
+            lines.append(
+                f"{phase:<20}{summary[phase]['total']:>12.4f}"
+                f"{summary[phase]['calls']:>8}"
+                f"{summary[phase]['total'] / total:>8.1%}"
+            )
+        for event in EVENTS:
+            lines.append(f"{event:<20}{summary[event]:>12}")
+        return "\n".join(lines)
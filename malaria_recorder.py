@@ -0,0 +1,142 @@
+import json
+
+import numpy as np
+
+from malaria_json import json_value, seed_description
+from malaria_core import COLUMNS
+
+
+class Recorder:
+    def __init__(self, steps, parameters=None, seed=None):
+        """
+        Buffers the update() tuples of a run in a preallocated array and
+        writes them to disk in one go. parameters and seed (an int or a
+        numpy.random.SeedSequence, see malaria_json.seed_description) are
+        stored as run metadata next to the data. The buffer doubles in size
+        when more than steps rows are recorded.
+        """
+        self.t = np.empty(steps, dtype=int)
+        self.data = np.empty((steps, len(COLUMNS)))
+        self.count = 0
+        self.metadata = {
+            "parameters": dict(parameters or {}),
+            "seed": seed_description(seed),
+            "columns": list(COLUMNS),
+        }
+
+    def record(self, t, data):
+        """
+        Store the update() tuple data of timestep t.
+        """
+        if self.count == self.t.size:
+            self.t = np.resize(self.t, 2 * self.count)
+            self.data = np.resize(self.data, (2 * self.count, len(COLUMNS)))
+        self.t[self.count] = t
+        self.data[self.count] = data
+        self.count += 1
+
+    def save(self, path):
+        """
+        Write the recorded rows to path. The format follows the extension:
+        .npz (NumPy, with metadata), .parquet (needs pyarrow, with metadata)
+        or .csv (comma separated t and data columns without header, the
+        format of the original simulation.csv, without metadata).
+        """
+        save(path, self.t[: self.count], self.data[: self.count], self.metadata)
+
+
+def save(path, t, data, metadata=None):
+    """
+    Write a trajectory with timesteps t and update() rows data to path, see
+    Recorder.save for the formats.
+    """
+    path = str(path)
+    metadata = metadata or {}
+
+    if path.endswith(".npz"):
+        np.savez(
+            path, t=t, data=data, metadata=json.dumps(metadata, default=json_value)
+        )
+
+    elif path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("writing .parquet files requires pyarrow")
+
+        columns = {"t": t}
+        columns.update({name: data[:, i] for i, name in enumerate(COLUMNS)})
+        table = pa.table(columns)
+        table = table.replace_schema_metadata(
+            {"malaria": json.dumps(metadata, default=json_value)}
+        )
+        pq.write_table(table, path)
+
+    elif path.endswith(".csv"):
+        np.savetxt(
+            path,
+            np.column_stack((t, data)),
+            delimiter=",",
+            fmt=["%d", "%s", "%s", "%d", "%d", "%s"],
+        )
+
+    else:
+        raise ValueError(f"unknown output format for {path}")
+
+
+def load(path):
+    """
+    Read a file written by Recorder.save or save and return the timesteps,
+    the update() rows and the metadata dictionary (empty for csv).
+    """
+    path = str(path)
+
+    if path.endswith(".npz"):
+        with np.load(path) as f:
+            return f["t"], f["data"], json.loads(str(f["metadata"]))
+
+    elif path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        metadata = json.loads(table.schema.metadata[b"malaria"])
+        data = np.column_stack([table[name].to_numpy() for name in COLUMNS])
+        return table["t"].to_numpy(), data, metadata
+
+    elif path.endswith(".csv"):
+        rows = np.loadtxt(path, delimiter=",", ndmin=2)
+        return rows[:, 0].astype(int), rows[:, 1:], {}
+
+    raise ValueError(f"unknown output format for {path}")
+
+
+def save_sweep(path, sweep, parameter, metadata=None):
+    """
+    Write the result of LAB5.parameter_sweep (a dictionary mapping the swept
+    values to dataframes) to a single .npz file instead of one csv per
+    value.
+    """
+    metadata = dict(metadata or {}, parameter=parameter, values=list(sweep.keys()))
+    arrays = dict()
+    for i, (value, df) in enumerate(sweep.items()):
+        for column in df.columns:
+            arrays[f"{i}/{column}"] = df[column].to_numpy()
+    np.savez(path, metadata=json.dumps(metadata, default=json_value), **arrays)
+
+
+def load_sweep(path):
+    """
+    Read a file written by save_sweep. Returns a dictionary mapping the
+    swept values (as strings) to dictionaries of column arrays, and the
+    metadata.
+    """
+    with np.load(path) as f:
+        metadata = json.loads(str(f["metadata"]))
+        sweep = {value: dict() for value in metadata["values"]}
+        for key in f.files:
+            if key == "metadata":
+                continue
+            i, column = key.split("/", 1)
+            sweep[metadata["values"][int(i)]][column] = f[key]
+    return sweep, metadata
@@ -0,0 +1,587 @@
+import warnings
+
+import numpy as np
+
+import malaria_checkpoint
+import malaria_kernels
+from malaria_core import FreeCells, Human, Mosquito, run_model
+from malaria_profile import StepProfiler
+
+"""
+Integer codes for the human states, the index matches the state strings used
+by the Human class.
+"""
+SUSCEPTIBLE = 0
+INFECTED = 1
+IMMUNE = 2
+STATE_NAMES = ("S", "I", "Immune")
+
+"""
+Compact dtypes of the agent arrays: grid coordinates up to 65535, the
+indices of the humans on the grid and the time counters lastInfection and
+lastImmunity, which saturate at their largest value instead of wrapping
+around. lastMeal never exceeds mealInterval + 1 and gets the smallest
+unsigned type that holds it (see counter_dtype).
+"""
+POSITION = np.uint16
+GRID_INDEX = np.int32
+COUNTER = np.uint16
+
+
+def counter_dtype(limit):
+    """
+    Smallest unsigned integer dtype that holds the values 0 .. limit.
+    """
+    return np.min_scalar_type(max(int(limit), 0))
+
+
+def increment(counter, index):
+    """
+    Adds one to counter[index], saturating at the largest value of the dtype
+    of counter.
+    """
+    limit = np.iinfo(counter.dtype).max
+    counter[index] = np.minimum(counter[index], limit - 1) + 1
+
+
+def transition_probability(age, period):
+    """
+    Probability that an infection (or immunity) of the given age ends in this
+    timestep. Same bell shaped curve as used by Model.update, evaluated for a
+    whole array of ages at once.
+    """
+    age = np.asarray(age, dtype=float)
+    return np.exp(-((age - period) ** 2) / np.sqrt(period))
+
+
+class VectorizedModel:
+    """
+    Names of the arrays that hold the state of the agents, see
+    bytes_per_agent.
+    """
+
+    mosquitoArrays = (
+        "mosquitoX",
+        "mosquitoY",
+        "mosquitoHungry",
+        "mosquitoInfected",
+        "mosquitoLastMeal",
+    )
+    humanArrays = (
+        "humanX",
+        "humanY",
+        "humanState",
+        "humanLastInfection",
+        "humanLastImmunity",
+    )
+
+    def __init__(
+        self,
+        width=50,
+        height=50,
+        nHuman=10,
+        nMosquito=20,
+        initMosquitoHungry=0.5,
+        initMosquitoInfected=0.2,
+        initHumanInfected=0.2,
+        humanInfectionProb=0.25,
+        mosquitoInfectionProb=0.9,
+        humanDeathByInfectionProb=0.3,
+        biteProb=1.0,
+        mealInterval=5,
+        infectionPeriod=3,
+        immuntiyPeriod=10,
+        humanNaturalDeathProb=0.001,
+        mosquitoNaturalDeathProb=0.1,
+        seed=None,
+        rng=None,
+        profile=False,
+        backend="numpy",
+    ):
+        """
+        Drop-in alternative for malaria_skeleton.Model. Instead of one Python
+        object per agent the population is stored as a struct of NumPy arrays
+        (one array per attribute) and every phase of a timestep is a batched
+        array operation. The parameters and the update() return value are the
+        same as for Model, including the seed/rng and profile arguments.
+
+        backend "numba" runs the move, bite, hunger and recovery phases as
+        compiled loops (malaria_kernels) instead of array operations. It
+        falls back to "numpy" with a warning when Numba is not installed.
+        Both backends follow the same rules, but draw their random numbers
+        differently, so a seed gives different (equally distributed) runs.
+
+        The agent arrays use the narrow dtypes POSITION, COUNTER and
+        counter_dtype(mealInterval + 1), see bytes_per_agent, so the grid
+        can be at most 65536 cells wide and high.
+        """
+        if backend not in ("numpy", "numba"):
+            raise ValueError(f"unknown backend {backend!r}")
+        if max(width, height) > np.iinfo(POSITION).max + 1:
+            raise ValueError("the grid can be at most 65536 cells wide and high")
+        if backend == "numba" and not malaria_kernels.HAVE_NUMBA:
+            warnings.warn("numba is not installed, using the numpy backend")
+            backend = "numpy"
+        self.backend = backend
+
+        self.height = height
+        self.width = width
+        self.nHuman = nHuman
+        self.nMosquito = nMosquito
+        self.initMosquitoHungry = initMosquitoHungry
+        self.initMosquitoInfected = initMosquitoInfected
+        self.humanInfectionProb = humanInfectionProb
+        self.mosquitoInfectionProb = mosquitoInfectionProb
+        self.humanDeathByInfectionProb = humanDeathByInfectionProb
+        self.biteProb = biteProb
+        self.mealInterval = mealInterval
+        self.infectionPeriod = infectionPeriod
+        self.immunityPeriod = immuntiyPeriod
+        self.humanNaturalDeathProb = humanNaturalDeathProb
+        self.mosquitoNaturalDeathProb = mosquitoNaturalDeathProb
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self.profiler = StepProfiler() if profile else None
+
+        """
+        Data parameters
+        To record the evolution of the model
+        """
+        self.infectedCount = 0
+        self.deathCount = 0
+        self.mosquitoDeathCount = 0
+        self.immunityCount = 0
+        self.mosquitoInfectedCount = 0
+        self.step = 0
+
+        """
+        Population setters
+        """
+        self.set_human_population(initHumanInfected)
+        self.set_mosquito_population(initMosquitoHungry, initMosquitoInfected)
+
+    def set_human_population(self, initHumanInfected):
+        """
+        Places the humans on distinct random free cells and infects the first
+        initHumanInfected fraction of them, like Model.set_human_population.
+        humanGrid maps every cell to the index of the human living there, or
+        -1 when the cell is empty.
+        """
+        self.freeCells = FreeCells(self.width, self.height, self.rng)
+        self.humanX, self.humanY = self.freeCells.take(self.nHuman).astype(POSITION)
+
+        self.humanState = np.where(
+            np.arange(self.nHuman) / self.nHuman <= initHumanInfected,
+            INFECTED,
+            SUSCEPTIBLE,
+        ).astype(np.int8)
+        self.humanLastInfection = np.zeros(self.nHuman, dtype=COUNTER)
+        self.humanLastImmunity = np.zeros(self.nHuman, dtype=COUNTER)
+
+        self.humanGrid = np.full((self.width, self.height), -1, dtype=GRID_INDEX)
+        self.humanGrid[self.humanX, self.humanY] = np.arange(self.nHuman)
+
+    def set_mosquito_population(self, initMosquitoHungry, initMosquitoInfected):
+        """
+        Places the mosquitos on random cells. The first initMosquitoHungry
+        fraction starts out hungry and each mosquito is infected with
+        probability initMosquitoInfected.
+        """
+        x = self.rng.integers(self.width, size=self.nMosquito)
+        y = self.rng.integers(self.height, size=self.nMosquito)
+        self.mosquitoX = x.astype(POSITION)
+        self.mosquitoY = y.astype(POSITION)
+        self.mosquitoHungry = self.respawn_hungry(np.arange(self.nMosquito))
+        self.mosquitoInfected = self.rng.random(self.nMosquito) <= initMosquitoInfected
+        self.mosquitoLastMeal = np.zeros(
+            self.nMosquito, dtype=counter_dtype(self.mealInterval + 1)
+        )
+
+    def save_checkpoint(self, path):
+        """
+        Writes the full state of the model to the directory path, see
+        Model.save_checkpoint.
+        """
+        malaria_checkpoint.save(self, path)
+
+    @classmethod
+    def load_checkpoint(cls, path, seed=None, rng=None, mmap=True, **options):
+        """
+        Creates a model from a checkpoint, see Model.load_checkpoint. With
+        mmap the agent arrays stay memory-mapped (copy-on-write).
+        """
+        return malaria_checkpoint.load(cls, path, seed, rng, mmap, **options)
+
+    def checkpoint_arrays(self):
+        """
+        The state of the agents as a dictionary of arrays.
+        """
+        arrays = {name: getattr(self, name) for name in malaria_checkpoint.ARRAYS[:-1]}
+        arrays["freeCells"] = self.freeCells.cells
+        return arrays
+
+    def restore_arrays(self, arrays):
+        """
+        Takes over the agent arrays of a checkpoint. Arrays of another dtype
+        (e.g. from a Model checkpoint) are converted to the dtypes of this
+        model, the others are used as they are.
+        """
+        for name in malaria_checkpoint.ARRAYS[:-1]:
+            dtype = getattr(self, name).dtype
+            setattr(self, name, np.asarray(arrays[name], dtype=dtype))
+
+    def bytes_per_agent(self):
+        """
+        Memory of the state of one mosquito and one human in bytes, the sum
+        of the item sizes of mosquitoArrays and humanArrays. The grid and
+        the pool of free cells depend on the grid size and are not counted.
+        """
+        return {
+            "mosquito": sum(
+                getattr(self, name).itemsize for name in self.mosquitoArrays
+            ),
+            "human": sum(getattr(self, name).itemsize for name in self.humanArrays),
+        }
+
+    def respawn_hungry(self, index):
+        """
+        Hungry state of (re)spawned mosquitos, which depends on the index of
+        the mosquito in the population just as in Model.
+        """
+        return index / self.nMosquito <= self.initMosquitoHungry
+
+    def update(self):
+        """
+        Perform one timestep and return its statistics, see Model.update.
+        """
+        self.advance()
+        return self.statistics()
+
+    def run(self, steps, every=1, observers=(), start=0):
+        """
+        Generator of the StepRecord of every every-th of the next steps
+        timesteps, see malaria_skeleton.run_model.
+        """
+        return run_model(self, steps, every, observers, start)
+
+    def advance(self):
+        """
+        Perform one timestep, see Model.advance. Every phase handles the whole
+        population at once. Bites within a step are resolved against the
+        human states at the start of the bite phase, so a human infected in
+        this step cannot yet infect another mosquito biting it in the same
+        step.
+        """
+        profiler = self.profiler
+        if profiler:
+            profiler.start()
+
+        self.move_mosquitoes()
+        self.mosquitoInfectedCount = self.count_infected_mosquitoes()
+        if profiler:
+            profiler.lap("move")
+
+        self.bite_humans()
+        if profiler:
+            profiler.lap("bite")
+
+        self.update_hunger()
+        if profiler:
+            profiler.lap("hunger")
+
+        self.mosquito_deaths()
+        if profiler:
+            profiler.lap("mosquito_death")
+
+        infectionDeaths = self.recover_humans()
+        if profiler:
+            profiler.lap("human_recovery")
+
+        self.human_deaths(infectionDeaths)
+        if profiler:
+            profiler.lap("human_death")
+            profiler.stop()
+
+        self.step += 1
+
+    def statistics(self):
+        """
+        The statistics of the last timestep, see Model.statistics.
+        """
+        return (
+            self.infectedCount / self.nHuman,
+            self.mosquitoInfectedCount / self.nMosquito,
+            self.deathCount,
+            self.mosquitoDeathCount,
+            self.immunityCount / self.nHuman,
+        )
+
+    def move_mosquitoes(self):
+        """
+        Moves every mosquito one step in a random direction with periodic
+        boundaries.
+        """
+        delta = self.rng.integers(-1, 2, size=(2, self.nMosquito))
+        if self.backend == "numba":
+            malaria_kernels.compiled("move_kernel")(
+                self.mosquitoX,
+                self.mosquitoY,
+                delta[0],
+                delta[1],
+                self.width,
+                self.height,
+            )
+            return
+        self.mosquitoX[:] = (self.mosquitoX + delta[0]) % self.width
+        self.mosquitoY[:] = (self.mosquitoY + delta[1]) % self.height
+
+    def count_infected_mosquitoes(self):
+        return int(np.count_nonzero(self.mosquitoInfected))
+
+    def bite_humans(self):
+        """
+        Hungry mosquitos on a cell with a human bite with probability
+        biteProb. Infected mosquitos can infect susceptible humans and
+        infected humans can infect non-infected mosquitos.
+        """
+        if self.backend == "numba":
+            roll = self.rng.random((2, self.nMosquito))
+            counts = malaria_kernels.compiled("bite_kernel")(
+                self.mosquitoX,
+                self.mosquitoY,
+                self.mosquitoHungry,
+                self.mosquitoInfected,
+                self.mosquitoLastMeal,
+                self.humanGrid,
+                self.humanState,
+                self.humanLastInfection,
+                roll[0],
+                roll[1],
+                self.biteProb,
+                self.humanInfectionProb,
+                self.mosquitoInfectionProb,
+            )
+            if self.profiler:
+                for event, n in zip(
+                    ("bites", "human_infections", "mosquito_infections"), counts
+                ):
+                    self.profiler.count(event, n)
+            return
+
+        target = self.humanGrid[self.mosquitoX, self.mosquitoY]
+        biting = np.flatnonzero(self.mosquitoHungry & (target >= 0))
+        biting = biting[self.rng.random(biting.size) <= self.biteProb]
+
+        humans = target[biting]
+        humanState = self.humanState[humans]
+        mosquitoInfected = self.mosquitoInfected[biting]
+        roll = self.rng.random(biting.size)
+
+        newHumans = humans[
+            mosquitoInfected
+            & (humanState == SUSCEPTIBLE)
+            & (roll <= self.humanInfectionProb)
+        ]
+        self.infect_humans(newHumans)
+
+        newMosquitos = biting[
+            ~mosquitoInfected
+            & (humanState == INFECTED)
+            & (roll <= self.mosquitoInfectionProb)
+        ]
+        self.mosquitoInfected[newMosquitos] = True
+
+        self.feed_mosquitoes(biting)
+
+        if self.profiler:
+            self.profiler.count("bites", biting.size)
+            self.profiler.count("human_infections", newHumans.size)
+            self.profiler.count("mosquito_infections", newMosquitos.size)
+
+    def infect_humans(self, index):
+        """
+        The given (susceptible) humans become infected.
+        """
+        self.humanState[index] = INFECTED
+        self.humanLastInfection[index] = 0
+
+    def feed_mosquitoes(self, index):
+        """
+        The given mosquitos had a meal and are no longer hungry.
+        """
+        self.mosquitoHungry[index] = False
+        self.mosquitoLastMeal[index] = 0
+
+    def update_hunger(self):
+        """
+        Mosquitos that are not hungry become hungry again after mealInterval
+        timesteps.
+        """
+        if self.backend == "numba":
+            malaria_kernels.compiled("hunger_kernel")(
+                self.mosquitoHungry, self.mosquitoLastMeal, self.mealInterval
+            )
+            return
+
+        sated = np.flatnonzero(~self.mosquitoHungry)
+        self.mosquitoLastMeal[sated] += 1
+        hungry = sated[self.mosquitoLastMeal[sated] > self.mealInterval]
+        self.mosquitoHungry[hungry] = True
+        self.mosquitoLastMeal[hungry] = 0
+
+    def mosquito_deaths(self):
+        """
+        Mosquitos die of natural causes and are replaced by a non-infected
+        mosquito on a random cell.
+        """
+        dead = np.flatnonzero(
+            self.rng.random(self.nMosquito) <= self.mosquitoNaturalDeathProb
+        )
+        self.mosquitoDeathCount += dead.size
+        if self.profiler:
+            self.profiler.count("mosquito_respawns", dead.size)
+
+        self.respawn_mosquitoes(dead)
+
+    def respawn_mosquitoes(self, dead):
+        """
+        Replaces the given mosquitos by non-infected mosquitos on random
+        cells.
+        """
+        self.mosquitoX[dead] = self.rng.integers(self.width, size=dead.size)
+        self.mosquitoY[dead] = self.rng.integers(self.height, size=dead.size)
+        self.mosquitoHungry[dead] = self.respawn_hungry(dead)
+        self.mosquitoInfected[dead] = False
+        self.mosquitoLastMeal[dead] = 0
+
+    def recover_humans(self):
+        """
+        Infected humans recover (and die or become immune) and immune humans
+        lose their immunity. Returns the indices of the humans that died of
+        the infection, they are replaced in human_deaths.
+        """
+        if self.backend == "numba":
+            roll = self.rng.random((3, self.nHuman))
+            recover = malaria_kernels.compiled("recover_kernel")
+            infectionDeaths, infected, deaths, immune = recover(
+                self.humanState,
+                self.humanLastInfection,
+                self.humanLastImmunity,
+                roll[0],
+                roll[1],
+                roll[2],
+                self.infectionPeriod,
+                self.immunityPeriod,
+                self.humanDeathByInfectionProb,
+                np.iinfo(COUNTER).max,
+            )
+            self.infectedCount += int(infected)
+            self.deathCount += int(deaths)
+            self.immunityCount += int(immune)
+            return infectionDeaths
+
+        infected = np.flatnonzero(self.humanState == INFECTED)
+        immune = np.flatnonzero(self.humanState == IMMUNE)
+
+        # add infection to the total when human just got infected
+        self.infectedCount += int(
+            np.count_nonzero(self.humanLastInfection[infected] == 0)
+        )
+
+        # end of infection according to normal probability
+        ends = self.rng.random(infected.size) <= transition_probability(
+            self.humanLastInfection[infected], self.infectionPeriod
+        )
+        increment(self.humanLastInfection, infected[~ends])
+        recovered = infected[ends]
+        self.infectedCount -= recovered.size
+
+        # human dies or gets immune
+        dies = self.rng.random(recovered.size) <= self.humanDeathByInfectionProb
+        infectionDeaths = recovered[dies]
+        newImmune = recovered[~dies]
+        self.deathCount += infectionDeaths.size
+        self.humanState[infectionDeaths] = SUSCEPTIBLE
+        self.humanState[newImmune] = IMMUNE
+        self.humanLastImmunity[newImmune] = 0
+        self.immunityCount += newImmune.size
+
+        # immunity decays according to the same kind of probability
+        increment(self.humanLastImmunity, immune)
+        loses = self.rng.random(immune.size) <= transition_probability(
+            self.humanLastImmunity[immune], self.immunityPeriod
+        )
+        self.immunityCount -= int(np.count_nonzero(loses))
+        self.humanState[immune[loses]] = SUSCEPTIBLE
+
+        return infectionDeaths
+
+    def human_deaths(self, infectionDeaths):
+        """
+        Humans die of natural causes. They and the humans in infectionDeaths
+        are replaced by susceptible humans on free cells.
+        """
+        # natural deaths
+        naturalDeaths = np.flatnonzero(
+            self.rng.random(self.nHuman) <= self.humanNaturalDeathProb
+        )
+        self.deathCount += naturalDeaths.size
+        state = self.humanState[naturalDeaths]
+        self.infectedCount -= int(np.count_nonzero(state == INFECTED))
+        self.immunityCount -= int(np.count_nonzero(state == IMMUNE))
+
+        self.rebirth_humans(np.union1d(infectionDeaths, naturalDeaths))
+
+    def rebirth_humans(self, index):
+        """
+        Replaces the given humans by susceptible humans on distinct free
+        cells, keeping humanGrid in sync.
+        """
+        if self.profiler:
+            self.profiler.count("human_rebirths", index.size)
+        if index.size == 0:
+            return
+
+        self.humanGrid[self.humanX[index], self.humanY[index]] = -1
+        self.freeCells.release(self.humanX[index], self.humanY[index])
+        self.humanX[index], self.humanY[index] = self.freeCells.take(index.size)
+        self.humanGrid[self.humanX[index], self.humanY[index]] = index
+
+        self.humanState[index] = SUSCEPTIBLE
+        self.humanLastInfection[index] = 0
+        self.humanLastImmunity[index] = 0
+
+    @property
+    def mosquitoPopulation(self):
+        """
+        The mosquitos as Mosquito objects, for code written against Model
+        (e.g. the visualization). Builds new objects on every access.
+        """
+        population = []
+        for i in range(self.nMosquito):
+            m = Mosquito(
+                int(self.mosquitoX[i]),
+                int(self.mosquitoY[i]),
+                bool(self.mosquitoHungry[i]),
+                bool(self.mosquitoInfected[i]),
+            )
+            m.lastMeal = int(self.mosquitoLastMeal[i])
+            population.append(m)
+        return population
+
+    @property
+    def humanPopulation(self):
+        """
+        The humans as Human objects, for code written against Model.
+        Builds new objects on every access.
+        """
+        population = []
+        for j in range(self.nHuman):
+            h = Human(
+                int(self.humanX[j]),
+                int(self.humanY[j]),
+                STATE_NAMES[self.humanState[j]],
+            )
+            h.lastInfection = int(self.humanLastInfection[j])
+            h.lastImmunity = int(self.humanLastImmunity[j])
+            population.append(h)
+        return population
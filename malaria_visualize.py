@@ -1,3 +1,7 @@
+import queue
+import struct
+import threading
+
 import numpy as np
 import matplotlib as mpl
 
@@ -7,61 +11,135 @@ import matplotlib.pylab as pl
 
 # from matplotlib.colors import ListedColormap, LinearSegmentedColormap
 
+from malaria_core import HUMAN_STATES
+
+"""
+Size in bytes of the .npy header written by AnimationExporter.
+"""
+NPY_HEADER_SIZE = 128
+
+
+def population_arrays(mosquitoPopulation, humanPopulation):
+    """
+    Positions and states of lists of Mosquito and Human objects as the
+    arrays expected by fill_grid.
+    """
+    mosquitoPositions = np.array(
+        [m.position for m in mosquitoPopulation], dtype=int
+    ).reshape(-1, 2)
+    humanPositions = np.array([h.position for h in humanPopulation], dtype=int)
+    humanPositions = humanPositions.reshape(-1, 2)
+    return (
+        mosquitoPositions[:, 0],
+        mosquitoPositions[:, 1],
+        np.array([m.infected for m in mosquitoPopulation], dtype=bool),
+        humanPositions[:, 0],
+        humanPositions[:, 1],
+        np.array([HUMAN_STATES[h.state] for h in humanPopulation], dtype=int),
+    )
+
+
+def model_arrays(model):
+    """
+    Positions and states of the agents of model as the arrays expected by
+    fill_grid. A model with array backed state
+    (malaria_vectorized.VectorizedModel) is read without touching the
+    individual agents.
+    """
+    if hasattr(model, "mosquitoX"):
+        return (
+            model.mosquitoX,
+            model.mosquitoY,
+            model.mosquitoInfected,
+            model.humanX,
+            model.humanY,
+            model.humanState,
+        )
+    return population_arrays(model.mosquitoPopulation, model.humanPopulation)
+
+
+def fill_grid(grid, mosquitoX, mosquitoY, mosquitoInfected, humanX, humanY, humanState):
+    """
+    Fills the data array grid from arrays of positions and states.
+    humanState holds the integer codes 0, 1 and 2 for susceptible, infected
+    and immune humans.
+
+    Visualizes the infected vs non-infected mosquitos (2, 1) respectively.
+    Visualizes the susceptible, infected and immune humans (-1, -2, -3)
+    respectively.
+    """
+    grid.fill(0)
+    grid[mosquitoX, mosquitoY] = np.where(mosquitoInfected, 2, 1)
+    grid[humanX, humanY] = -1 - np.asarray(humanState)
+
+
+def draw_legend(fig):
+    """
+    Adds the color legend of the agent states to fig.
+    """
+    colors = pl.cm.rainbow(np.linspace(0, 1, 6))
+    fig.text(0.02, 0.5, "M: inf", color=colors[5], fontsize=14)
+    fig.text(0.02, 0.45, "M: not-inf", color=colors[4], fontsize=14)
+    fig.text(0.02, 0.35, "H: sus", color=colors[2], fontsize=14)
+    fig.text(0.02, 0.3, "H: inf", color=colors[1], fontsize=14)
+    fig.text(0.02, 0.25, "H: imm", color=colors[0], fontsize=14)
+    fig.subplots_adjust(left=0.3)
+
 
 class Visualization:
     def __init__(self, height, width, pauseTime=0.1):
         """
         This simple visualization shows the population of mosquitos and humans.
         Each subject is color coded according to its state.
+        After every update the visualization pauses for pauseTime seconds,
+        a pauseTime of 0 or None draws the frame without pausing.
         """
         self.h = height
         self.w = width
         self.pauseTime = pauseTime
-        grid = np.zeros((self.w, self.h))
+
+        # data array, reused for every frame
+        self.grid = np.zeros((self.w, self.h))
         """
         Color information
         """
-        colors = pl.cm.rainbow(np.linspace(0, 1, 6))
-        self.im = plt.imshow(grid, vmin=-3, vmax=2, cmap="rainbow")
-
-        fig = plt.gcf()
-        fig.text(0.02, 0.5, "M: inf", color=colors[5], fontsize=14)
-        fig.text(0.02, 0.45, "M: not-inf", color=colors[4], fontsize=14)
-        fig.text(0.02, 0.35, "H: sus", color=colors[2], fontsize=14)
-        fig.text(0.02, 0.3, "H: inf", color=colors[1], fontsize=14)
-        fig.text(0.02, 0.25, "H: imm", color=colors[0], fontsize=14)
-        plt.subplots_adjust(left=0.3)
+        self.im = plt.imshow(self.grid, vmin=-3, vmax=2, cmap="rainbow")
+        draw_legend(plt.gcf())
 
     def update(self, t, mosquitoPopulation, humanPopulation):
         """
         Updates the data array, and draws the data.
         """
-        grid = np.zeros((self.w, self.h))
+        self.update_arrays(t, *population_arrays(mosquitoPopulation, humanPopulation))
 
+    def update_model(self, t, model):
         """
-        Visualizes the infected vs non-infected mosquitos (2, 1) respectively.
-        Visualizes the susceptible, infected and immune humans (-1, -2, -3)
-        respectively.
+        Draws the current state of model, see model_arrays.
         """
-        for m in mosquitoPopulation:
-            if m.infected:
-                grid[m.position[0]][m.position[1]] = 2
-            else:
-                grid[m.position[0]][m.position[1]] = 1
+        self.update_arrays(t, *model_arrays(model))
 
-        for h in humanPopulation:
-            if h.state == "S":
-                grid[h.position[0]][h.position[1]] = -1
-            elif h.state == "I":
-                grid[h.position[0]][h.position[1]] = -2
-            elif h.state == "Immune":
-                grid[h.position[0]][h.position[1]] = -3
+    def update_arrays(
+        self, t, mosquitoX, mosquitoY, mosquitoInfected, humanX, humanY, humanState
+    ):
+        """
+        Updates the data array from arrays of positions and states (see
+        fill_grid) and draws the data.
+        """
+        grid = self.grid
+        fill_grid(
+            grid, mosquitoX, mosquitoY, mosquitoInfected, humanX, humanY, humanState
+        )
 
         self.im.set_data(grid)
 
-        plt.draw()
         plt.title("t = %i" % t)
-        plt.pause(0.1)
+        if self.pauseTime:
+            plt.draw()
+            plt.pause(self.pauseTime)
+        else:
+            # draw without waiting, the window is refreshed without a pause
+            self.im.figure.canvas.draw_idle()
+            self.im.figure.canvas.flush_events()
 
     def persist(self):
         """
@@ -71,6 +149,177 @@ class Visualization:
         plt.show()
 
 
+class AnimationExporter:
+    def __init__(self, height, width, path, every=1, fps=10, dpi=100, maxQueue=64):
+        """
+        Headless version of Visualization that renders every k-th frame
+        offscreen (Agg canvas, no display needed) and streams the frames to
+        path. The format follows the extension: .npy (array of RGB frames),
+        .gif (needs Pillow) or .mp4 (needs ffmpeg).
+
+        The simulation only copies the data array into a queue. Rendering
+        and writing happen in a background thread, so the simulation loop
+        is only held up when more than maxQueue frames are waiting. An
+        error of the thread is raised by the next update or close().
+        """
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.h = height
+        self.w = width
+        self.path = str(path)
+        self.every = every
+        self.grid = np.zeros((self.w, self.h))
+
+        self.fig = Figure(dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax = self.fig.add_subplot()
+        self.im = ax.imshow(self.grid, vmin=-3, vmax=2, cmap="rainbow")
+        self.title = ax.set_title("")
+        draw_legend(self.fig)
+
+        # preallocated RGB frame buffer
+        self.canvas.draw()
+        rows, columns = self.canvas.get_width_height()[::-1]
+        self.frame = np.empty((rows, columns, 3), dtype=np.uint8)
+        self.frameCount = 0
+
+        if self.path.endswith(".npy"):
+            self.file = open(self.path, "wb")
+            self.write_npy_header()
+        else:
+            from matplotlib import animation
+
+            if self.path.endswith(".gif"):
+                self.movie = animation.PillowWriter(fps=fps)
+            elif self.path.endswith(".mp4"):
+                self.movie = animation.FFMpegWriter(fps=fps)
+            else:
+                raise ValueError(f"unknown animation format for {self.path}")
+            self.movie.setup(self.fig, self.path, dpi=dpi)
+
+        self.queue = queue.Queue(maxsize=maxQueue)
+        self.error = None
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def update(self, t, mosquitoPopulation, humanPopulation):
+        """
+        Queues a frame of the given populations if t is a multiple of every.
+        """
+        if t % self.every == 0:
+            self.update_arrays(
+                t, *population_arrays(mosquitoPopulation, humanPopulation)
+            )
+
+    def update_model(self, t, model):
+        """
+        Queues a frame of model if t is a multiple of every.
+        """
+        if t % self.every == 0:
+            self.update_arrays(t, *model_arrays(model))
+
+    def update_arrays(
+        self, t, mosquitoX, mosquitoY, mosquitoInfected, humanX, humanY, humanState
+    ):
+        """
+        Queues a frame built from arrays of positions and states, see
+        fill_grid. Not decimated.
+        """
+        fill_grid(
+            self.grid,
+            mosquitoX,
+            mosquitoY,
+            mosquitoInfected,
+            humanX,
+            humanY,
+            humanState,
+        )
+        self.put((t, self.grid.astype(np.int8)))
+
+    def put(self, item):
+        """
+        Queues item for the writer thread, waiting while the queue is full.
+        Raises the error of the thread if it failed, instead of waiting for
+        it forever.
+        """
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if not self.thread.is_alive() and self.error is None:
+                    raise RuntimeError("the animation writer thread stopped")
+
+    def write_frames(self):
+        """
+        Background thread: renders the queued frames and writes them until
+        close() queues None. An error stops the thread and is kept in
+        error.
+        """
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                t, grid = item
+                self.im.set_data(grid)
+                self.title.set_text("t = %i" % t)
+
+                if self.path.endswith(".npy"):
+                    self.canvas.draw()
+                    self.frame[...] = np.asarray(self.canvas.buffer_rgba())[..., :3]
+                    self.file.write(self.frame.tobytes())
+                else:
+                    self.movie.grab_frame()
+                self.frameCount += 1
+        except Exception as error:
+            self.error = error
+
+    def write_npy_header(self):
+        """
+        Writes the .npy header for the frames written so far. The header has
+        a fixed size, so it is written at the start and rewritten with the
+        final number of frames on close().
+        """
+        header = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % (
+            (self.frameCount,) + self.frame.shape,
+        )
+        header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+        self.file.seek(0)
+        self.file.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)))
+        self.file.write(header.encode("latin1"))
+        self.file.seek(0, 2)
+
+    def close(self):
+        """
+        Waits until all queued frames are written and closes the output.
+        Raises the error of the writer thread if it failed.
+        """
+        try:
+            self.put(None)
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+        except Exception:
+            if self.path.endswith(".npy"):
+                self.file.close()
+            raise
+        if self.path.endswith(".npy"):
+            self.write_npy_header()
+            self.file.close()
+        else:
+            self.movie.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 """
 * EXAMPLE USAGE *
 